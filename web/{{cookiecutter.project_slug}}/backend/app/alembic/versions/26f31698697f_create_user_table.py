@@ -0,0 +1,37 @@
+"""Create user table
+
+Revision ID: 26f31698697f
+Revises: 
+Create Date: 2026-10-18 09:12:41.318264
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "26f31698697f"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("full_name", sa.String(), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=False),
+        sa.Column("is_superuser", sa.Boolean(), nullable=False),
+        sa.Column("version", sa.Integer(), server_default=sa.text("1"), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_user")),
+        sa.UniqueConstraint("email", name=op.f("uq_user_email")),
+    )
+    op.create_index(op.f("ix_user_full_name"), "user", ["full_name"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_user_full_name"), table_name="user")
+    op.drop_table("user")
@@ -0,0 +1,50 @@
+"""Add user search indexes
+
+Revision ID: c0edd7bc20ba
+Revises: 26f31698697f
+Create Date: 2026-10-18 09:20:05.772410
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c0edd7bc20ba"
+down_revision = "26f31698697f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # Build concurrently so large tables stay writable, which can't happen inside
+    # the migration's transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_user_full_name_trgm",
+            "user",
+            ["full_name"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_ops={"full_name": "gin_trgm_ops"},
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_user_email_trgm",
+            "user",
+            ["email"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_user_email_trgm", table_name="user", postgresql_concurrently=True
+        )
+        op.drop_index(
+            "ix_user_full_name_trgm", table_name="user", postgresql_concurrently=True
+        )
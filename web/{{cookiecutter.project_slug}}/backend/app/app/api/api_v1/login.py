@@ -1,4 +1,3 @@
-from datetime import timedelta
 from typing import Annotated, Any
 
 from fastapi import APIRouter, Body, Depends, HTTPException, status
@@ -8,13 +7,17 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import auth, crud, schemas
 from app.api import deps
-from app.config import settings
 from app.tasks import send_reset_password_email
 
 router = APIRouter()
 
 
-@router.post("/login/access-token", response_model=schemas.Token)
+@router.post(
+    "/login/access-token",
+    response_model=schemas.Token,
+    dependencies=[Depends(deps.throttle_login)],
+    responses={429: {}},
+)
 async def login_for_access_token(
     db: Annotated[AsyncSession, Depends(deps.get_db)],
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
@@ -51,14 +54,10 @@ async def recover_password(
             detail="The user with this username does not exist in the system",
         )
 
-    token_data = schemas.TokenData(user_id=user.id)
-    reset_token = auth.create_access_token(
-        token_data,
-        expires_delta=timedelta(hours=settings.email_reset_token_expire_hours),
+    crud.outbox.enqueue(
+        db, send_reset_password_email.s(email, username=email, user_id=user.id)
     )
 
-    send_reset_password_email.delay(email, username=email, token=reset_token)
-
     return {"msg": "Password recovery email sent"}
 
 
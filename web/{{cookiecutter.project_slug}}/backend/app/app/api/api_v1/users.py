@@ -1,16 +1,55 @@
-from typing import Annotated, Sequence
+from collections.abc import AsyncIterator
+from typing import Annotated, Any, Literal, Sequence, cast
 
-from fastapi import APIRouter, Body, Depends, HTTPException, Response, status
-from pydantic import EmailStr
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import EmailStr, ValidationError
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, models, schemas
-from app.api import deps
+from app import crud, encoders, models, schemas
+from app.api import deps, etag
 from app.config import settings
-from app.tasks import send_new_account_email
+from app.crud.base import Page
+from app.db import async_session, read_session
+from app.tasks import send_new_account_email, send_new_account_emails
 
 router = APIRouter()
 
+IMPORT_BATCH_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+
+
+def rows_response(
+    rows: Sequence[Row[Any]], fields: Sequence[str], response: Response
+) -> Response:
+    # Rows are selected starting with exactly these fields, so they're encoded as
+    # is instead of being validated against the response model first
+    if response.status_code == status.HTTP_204_NO_CONTENT:
+        return Response(status_code=response.status_code, headers=response.headers)
+
+    return ORJSONResponse(
+        [dict(zip(fields, row)) for row in rows],
+        status_code=response.status_code or status.HTTP_200_OK,
+        headers=dict(response.headers),
+    )
+
+
+def fields_response(obj: Any, fields: Sequence[str], response: Response) -> Response:
+    return ORJSONResponse(
+        {field: getattr(obj, field) for field in fields},
+        headers=dict(response.headers),
+    )
+
 
 @router.post(
     "/",
@@ -24,22 +63,131 @@ async def create_user(
     """
     Create new user.
     """
-    if await crud.user.get_by_email(db, user_in.email):
+    user = await crud.user.create(db, user_in)
+    if not user:
         raise HTTPException(
             status.HTTP_400_BAD_REQUEST,
             detail="The user with this username already exists in the system",
         )
 
-    user = await crud.user.create(db, user_in)
-
     if settings.emails_enabled:
-        send_new_account_email.delay(
-            user_in.email, username=user_in.email, password=user_in.password
+        crud.outbox.enqueue(
+            db,
+            send_new_account_email.s(user.email, username=user.email, user_id=user.id),
         )
 
     return user
 
 
+@router.post(
+    "/import",
+    response_model=schemas.UserImportResult,
+    dependencies=[Depends(deps.get_current_active_superuser)],
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "text/csv": {"schema": {"type": "string"}},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+            "required": True,
+        }
+    },
+)
+async def import_users(request: Request) -> schemas.UserImportResult:
+    """
+    Create users in bulk from a CSV (with a header row) or NDJSON body.
+
+    Invalid rows and emails that already exist are reported per row. Users are
+    committed in batches, so rows before a failure stay imported.
+    """
+    content_type = request.headers.get("content-type", "").partition(";")[0]
+    lines = encoders.iter_lines(request.stream())
+    if content_type == "text/csv":
+        records = encoders.decode_csv(lines)
+    elif content_type == "application/x-ndjson":
+        records = encoders.decode_ndjson(lines)
+    else:
+        raise HTTPException(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Expected a text/csv or application/x-ndjson body",
+        )
+
+    result = schemas.UserImportResult()
+    seen: set[str] = set()
+    batch: list[tuple[int, schemas.UserCreate]] = []
+
+    async def create_batch() -> None:
+        # A session per batch holds a connection and row locks just for the
+        # INSERT, not while the rest of the body is read and hashed
+        async with async_session.begin() as db:
+            users = await crud.user.create_many(db, [user_in for _, user_in in batch])
+            if settings.emails_enabled and users:
+                crud.outbox.enqueue(
+                    db,
+                    send_new_account_emails.s(
+                        [
+                            dict(to=user.email, username=user.email, user_id=user.id)
+                            for user in users
+                        ]
+                    ),
+                )
+
+        created = {user.email for user in users}
+        result.created += len(users)
+        result.errors += [
+            schemas.UserImportError(
+                row=row,
+                email=user_in.email,
+                detail="The user with this username already exists in the system",
+            )
+            for row, user_in in batch
+            if user_in.email not in created
+        ]
+
+        batch.clear()
+
+    row = 0
+    try:
+        async for record in records:
+            row += 1
+            if isinstance(record, dict):
+                # Let empty CSV cells fall back to the schema defaults
+                record = {k: v for k, v in record.items() if v != ""}
+
+            try:
+                user_in = schemas.UserCreate.model_validate(record)
+            except ValidationError as e:
+                # Name the fields only, the input may hold the row's password
+                detail = "; ".join(
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                    for error in e.errors()
+                )
+                result.errors.append(schemas.UserImportError(row=row, detail=detail))
+                continue
+
+            if user_in.email in seen:
+                result.errors.append(
+                    schemas.UserImportError(
+                        row=row, email=user_in.email, detail="Duplicate email"
+                    )
+                )
+                continue
+
+            seen.add(user_in.email)
+            batch.append((row, user_in))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await create_batch()
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, detail=f"Malformed body at row {row + 1}"
+        )
+
+    await create_batch()
+    result.errors.sort(key=lambda error: error.row)
+
+    return result
+
+
 @router.post("/open", response_model=schemas.User, status_code=status.HTTP_201_CREATED)
 async def create_user_open(
     db: Annotated[AsyncSession, Depends(deps.get_db)],
@@ -56,14 +204,15 @@ async def create_user_open(
             detail="Open user registration is forbidden on this server",
         )
 
-    if await crud.user.get_by_email(db, email):
+    user_in = schemas.UserCreate(email=email, password=password, full_name=full_name)
+    user = await crud.user.create(db, user_in)
+    if not user:
         raise HTTPException(
             status.HTTP_400_BAD_REQUEST,
             detail="The user with this username already exists in the system",
         )
 
-    user_in = schemas.UserCreate(email=email, password=password, full_name=full_name)
-    return await crud.user.create(db, user_in)
+    return user
 
 
 @router.get(
@@ -73,42 +222,242 @@ async def create_user_open(
     responses={204: {}},
 )
 async def read_users(
+    db: Annotated[AsyncSession, Depends(deps.get_read_db)],
+    response: Response,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(gt=0, le=1000)] = 100,
+    order_by: Literal["id", "email", "full_name"] = "id",
+    fields: Annotated[list[str] | None, Depends(deps.get_user_fields)] = None,
+    count: Literal["exact", "estimated"] | None = None,
+) -> Sequence[models.User | Row[Any]] | Response:
+    """
+    Retrieve users.
+
+    Pass the X-Next-Cursor response header back as cursor to get the next page.
+    Pass fields to only get those fields of each user.
+    Pass count to get the total number of users in the X-Total-Count header,
+    estimated counts are much cheaper on large tables.
+    """
+    if count:
+        total = await crud.user.count(db, estimated=count == "estimated")
+        response.headers["X-Total-Count"] = str(total)
+
+    if settings.fast_responses and not fields:
+        fields = list(schemas.User.model_fields)
+
+    page: Page[models.User] | Page[Row[Any]]
+    try:
+        if fields:
+            page = await crud.user.get_all(db, cursor, limit, order_by, columns=fields)
+        else:
+            page = await crud.user.get_all(db, cursor, limit, order_by)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+
+    if not page.items:
+        response.status_code = status.HTTP_204_NO_CONTENT
+
+    if fields:
+        return rows_response(cast(Sequence[Row[Any]], page.items), fields, response)
+
+    return page.items
+
+
+@router.patch("/", response_model=schemas.UserBulkUpdateResult)
+async def update_users(
     db: Annotated[AsyncSession, Depends(deps.get_db)],
+    current_user: Annotated[models.User, Depends(deps.get_current_active_superuser)],
+    user_in: schemas.UserBulkUpdate,
+) -> schemas.UserBulkUpdateResult:
+    """
+    Update every user matching the filter in a single statement.
+
+    Nothing is updated when the filter would deactivate or demote the current
+    user, so there is always an active superuser left.
+    """
+    update_data = user_in.model_dump(exclude={"filter"}, exclude_none=True)
+    if not update_data:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Nothing to update")
+
+    filters = user_in.filter.model_dump(exclude={"ids"}, exclude_none=True)
+    try:
+        ids = await crud.user.update_many(
+            db, update_data, ids=user_in.filter.ids, filters=filters
+        )
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # Raising rolls the update back along with the request's transaction
+    if current_user.id in ids and not (
+        update_data.get("is_active", True) and update_data.get("is_superuser", True)
+    ):
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail="Can't deactivate or demote the current user",
+        )
+
+    return schemas.UserBulkUpdateResult(count=len(ids))
+
+
+@router.get(
+    "/batch",
+    response_model=list[schemas.User],
+    dependencies=[Depends(deps.get_current_active_superuser)],
+)
+async def read_users_batch(
+    db: Annotated[AsyncSession, Depends(deps.get_read_db)],
+    ids: Annotated[list[int], Query(max_length=1000)],
+    response: Response,
+    fields: Annotated[list[str] | None, Depends(deps.get_user_fields)] = None,
+) -> Sequence[models.User | Row[Any]] | Response:
+    """
+    Retrieve many users by id in one request.
+    """
+    if settings.fast_responses and not fields:
+        fields = list(schemas.User.model_fields)
+
+    if fields:
+        rows = await crud.user.get_many(db, ids, fields)
+        return rows_response(rows, fields, response)
+
+    return await crud.user.get_many(db, ids)
+
+
+@router.get(
+    "/search",
+    response_model=list[schemas.User],
+    dependencies=[Depends(deps.get_current_active_superuser)],
+    responses={204: {}},
+)
+async def search_users(
+    db: Annotated[AsyncSession, Depends(deps.get_read_db)],
     response: Response,
-    skip_id: int = 0,
-    limit: int = 100,
+    q: Annotated[str, Query(min_length=3, max_length=100)],
+    prefix: bool = False,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(gt=0, le=1000)] = 100,
+    count: Literal["exact", "estimated"] | None = None,
 ) -> Sequence[models.User]:
     """
-    Retrieve users.
+    Search users by full name or email, best matches first.
+
+    Matches anywhere in either field, or only at the start with prefix.
+    Pass the X-Next-Cursor response header back as cursor to get the next page.
+    Pass count to get the total number of matches in the X-Total-Count header.
     """
-    users = await crud.user.get_all(db, skip_id, limit)
+    if count:
+        total = await crud.user.count(
+            db, crud.user.search_filter(q, prefix), estimated=count == "estimated"
+        )
+        response.headers["X-Total-Count"] = str(total)
+
+    try:
+        page = await crud.user.search(db, q, prefix, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    if not users:
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+
+    if not page.items:
         response.status_code = status.HTTP_204_NO_CONTENT
 
-    return users
+    return page.items
+
+
+async def export_chunks(format: Literal["ndjson", "csv"]) -> AsyncIterator[bytes]:
+    fields = list(schemas.User.model_fields)
+    if format == "csv":
+        yield encoders.encode_csv([fields])
+
+    # Page through the table with a short session per page, so a slow client
+    # never holds a pooled connection or a transaction open
+    cursor = None
+    while True:
+        async with read_session() as db:
+            page = await crud.user.get_all(
+                db, cursor, EXPORT_BATCH_SIZE, columns=fields
+            )
+
+        # Rows come back with the selected columns in order
+        if format == "csv":
+            yield encoders.encode_csv(page.items)
+        else:
+            yield encoders.encode_ndjson(row._mapping for row in page.items)
+
+        cursor = page.next_cursor
+        if not cursor:
+            break
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    dependencies=[Depends(deps.get_current_active_superuser)],
+    responses={200: {"content": {"application/x-ndjson": {}, "text/csv": {}}}},
+)
+async def export_users(
+    format: Literal["ndjson", "csv"] = "ndjson"
+) -> StreamingResponse:
+    """
+    Stream all users as NDJSON or CSV.
+    """
+    return StreamingResponse(
+        export_chunks(format),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="users.{format}"'},
+    )
 
 
 @router.get("/me", response_model=schemas.User)
 async def read_user_me(
-    current_user: Annotated[models.User, Depends(deps.get_current_active_user)]
-) -> models.User:
+    request: Request,
+    response: Response,
+    current_user: Annotated[models.User, Depends(deps.get_current_active_user)],
+    fields: Annotated[list[str] | None, Depends(deps.get_user_fields)] = None,
+) -> models.User | Response:
     """
     Get current user.
+
+    Send the ETag back as If-None-Match to get a 304 while the user is unchanged.
     """
+    tag = etag.make(current_user.id, current_user.version, fields)
+    if etag.matches(request, tag):
+        return etag.not_modified(tag)
+
+    response.headers["ETag"] = tag
+    if fields:
+        return fields_response(current_user, fields, response)
+
     return current_user
 
 
 @router.get("/{user_id}", response_model=schemas.User)
 async def read_user_by_id(
-    db: Annotated[AsyncSession, Depends(deps.get_db)],
+    db: Annotated[AsyncSession, Depends(deps.get_read_db)],
+    request: Request,
+    response: Response,
     current_user: Annotated[models.User, Depends(deps.get_current_active_user)],
     user_id: int,
-) -> models.User:
+    fields: Annotated[list[str] | None, Depends(deps.get_user_fields)] = None,
+) -> models.User | Response:
     """
     Get a specific user by id.
+
+    Send the ETag back as If-None-Match to get a 304 while the user is unchanged.
     """
     if current_user.id == user_id:
+        tag = etag.make(current_user.id, current_user.version, fields)
+        if etag.matches(request, tag):
+            return etag.not_modified(tag)
+
+        response.headers["ETag"] = tag
+        if fields:
+            return fields_response(current_user, fields, response)
+
         return current_user
 
     if not current_user.is_superuser:
@@ -117,10 +466,28 @@ async def read_user_by_id(
             detail="The user doesn't have enough privileges",
         )
 
+    # Answer revalidations from the version alone, without loading the row
+    if "if-none-match" in request.headers:
+        version = await crud.user.get_version(db, user_id)
+        if version is not None:
+            tag = etag.make(user_id, version, fields)
+            if etag.matches(request, tag):
+                return etag.not_modified(tag)
+
+    if fields:
+        # The version comes along for the ETag but isn't part of the payload
+        row = await crud.user.get(db, user_id, [*fields, "version"])
+        if not row:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
+
+        response.headers["ETag"] = etag.make(user_id, row.version, fields)
+        return fields_response(row, fields, response)
+
     user = await crud.user.get(db, user_id)
     if not user:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
 
+    response.headers["ETag"] = etag.make(user.id, user.version)
     return user
 
 
@@ -135,7 +502,9 @@ async def update_user_me(
     """
     Update own user.
     """
-    user_in = schemas.UserUpdate.model_validate(current_user)
+    # Only the fields sent are written, current_user may come from a stale cache
+    # or replica and mustn't write back flags like is_superuser
+    user_in = schemas.UserUpdate()
 
     if email is not None:
         user_in.email = email
@@ -144,7 +513,11 @@ async def update_user_me(
     if full_name is not None:
         user_in.full_name = full_name
 
-    return await crud.user.update(db, current_user.id, user_in)
+    user = await crud.user.update(db, current_user.id, user_in)
+    if not user:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    return user
 
 
 @router.put(
@@ -160,10 +533,11 @@ async def update_user(
     """
     Update a user.
     """
-    if not await crud.user.get(db, user_id):
+    user = await crud.user.update(db, user_id, user_in)
+    if not user:
         raise HTTPException(
             status.HTTP_404_NOT_FOUND,
             detail="The user with this username does not exist in the system",
         )
 
-    return await crud.user.update(db, user_id, user_in)
+    return user
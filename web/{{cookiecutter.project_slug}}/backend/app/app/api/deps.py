@@ -1,13 +1,20 @@
+import math
 from collections.abc import AsyncIterator
 from typing import Annotated
 
-from fastapi import Depends, HTTPException, Security, status
-from fastapi.security import OAuth2PasswordBearer, SecurityScopes
+from fastapi import Depends, HTTPException, Query, Request, Security, status
+from fastapi.security import (
+    OAuth2PasswordBearer,
+    OAuth2PasswordRequestForm,
+    SecurityScopes,
+)
+from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import auth, crud, models
+from app import auth, crud, models, schemas, throttling
 from app.config import settings
-from app.db import async_session
+from app.db import async_session, read_session
+from app.hashing import hasher
 
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl=f"{settings.api_v1_str}/login/access-token",
@@ -16,12 +23,17 @@ oauth2_scheme = OAuth2PasswordBearer(
 
 
 async def get_db() -> AsyncIterator[AsyncSession]:
+    # The session only checks out a connection, and emits BEGIN, on first use
     async with async_session.begin() as session:
         yield session
 
 
+async def get_read_db() -> AsyncIterator[AsyncSession]:
+    async with read_session() as session:
+        yield session
+
+
 async def get_current_user(
-    db: Annotated[AsyncSession, Depends(get_db)],
     security_scopes: SecurityScopes,
     token: Annotated[str, Depends(oauth2_scheme)],
 ) -> models.User:
@@ -37,7 +49,11 @@ async def get_current_user(
             headers={"WWW-Authenticate": authenticate_value},
         )
 
-    user = await crud.user.get(db, token_data.user_id)
+    # Use a short-lived session so the connection goes back to the pool right
+    # away instead of being held for the rest of the request. Read from the
+    # primary, a lagging replica could re-cache a row changed since
+    async with async_session() as db:
+        user = await crud.user.get_cached(db, token_data.user_id)
     if not user:
         raise HTTPException(
             status.HTTP_404_NOT_FOUND,
@@ -75,3 +91,66 @@ async def get_current_active_superuser(
         )
 
     return user
+
+
+def client_host(request: Request) -> str:
+    hops = settings.login_client_proxy_hops
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if hops and forwarded_for:
+        hosts = forwarded_for.split(",")
+        if len(hosts) >= hops:
+            return hosts[-hops].strip()
+
+    return request.client.host if request.client else ""
+
+
+async def throttle_login(
+    request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
+) -> None:
+    # Fail fast instead of queueing more bcrypt work than the pool can absorb
+    if (
+        hasher.queue_depth + hasher.in_flight
+        >= settings.login_max_pending_verifications
+    ):
+        retry_after = 1.0
+    else:
+        retry_after = await throttling.login_client_limiter.hit(client_host(request))
+        if not retry_after:
+            retry_after = await throttling.login_account_limiter.hit(
+                form_data.username.lower()
+            )
+
+    if retry_after:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+class FieldSelector:
+    """
+    Validate a fields query parameter against the fields of a response schema
+    """
+
+    def __init__(self, schema: type[BaseModel]):
+        self.fields = list(schema.model_fields)
+
+    def __call__(
+        self, fields: Annotated[list[str] | None, Query()] = None
+    ) -> list[str] | None:
+        if not fields:
+            return None
+
+        unknown = set(fields).difference(self.fields)
+        if unknown:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}",
+            )
+
+        # Keep the schema's field order and drop duplicates
+        return [field for field in self.fields if field in fields]
+
+
+get_user_fields = FieldSelector(schemas.User)
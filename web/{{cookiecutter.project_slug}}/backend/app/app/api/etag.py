@@ -0,0 +1,27 @@
+from collections.abc import Sequence
+
+from fastapi import Request, Response, status
+
+
+def make(id: int, version: int, fields: Sequence[str] | None = None) -> str:
+    # Strong, since the version changes whenever any column of the row does.
+    # Each field selection is a different representation, so it gets its own tag
+    if fields:
+        return f'"{id}.{version}.{"+".join(fields)}"'
+
+    return f'"{id}.{version}"'
+
+
+def matches(request: Request, tag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    # If-None-Match uses the weak comparison, which ignores the W/ prefix
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+
+    return "*" in tags or tag in tags
+
+
+def not_modified(tag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": tag})
@@ -1,3 +1,16 @@
 from celery import Celery
 
-app = Celery("app", broker="amqp://guest@queue//", include=["app.tasks"])
+from app.config import settings
+
+app = Celery("app", broker=settings.celery_broker_url, include=["app.tasks"])
+app.conf.update(
+    task_default_queue="main-queue",
+    task_routes={
+        "app.tasks.send_reset_password_email": {"queue": "high-priority"},
+        "app.tasks.send_new_account_emails": {"queue": "bulk"},
+    },
+    task_acks_late=settings.celery_task_acks_late,
+    task_reject_on_worker_lost=settings.celery_task_acks_late,
+    worker_concurrency=settings.celery_worker_concurrency,
+    worker_prefetch_multiplier=settings.celery_worker_prefetch_multiplier,
+)
@@ -0,0 +1,171 @@
+import zlib
+from collections.abc import Callable, Sequence
+from typing import Protocol
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class Compressor(Protocol):
+    def compress(self, data: bytes, final: bool) -> bytes:
+        """
+        Compress a chunk, flushing so far as the client can decode it right away
+        """
+        ...
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        flush = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(data) + self._compressor.flush(flush)
+
+
+class BrotliCompressor:
+    def __init__(self, level: int):
+        import brotli
+
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        chunk = self._compressor.process(data)
+        return chunk + (
+            self._compressor.finish() if final else self._compressor.flush()
+        )
+
+
+class ZstdCompressor:
+    def __init__(self, level: int):
+        import zstandard
+
+        self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self._compressor = zstandard.ZstdCompressor(level).compressobj()
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        chunk = self._compressor.compress(data)
+        if final:
+            return chunk + self._compressor.flush()
+
+        return chunk + self._compressor.flush(self._flush_block)
+
+
+def negotiate(accept_encoding: str, encodings: Sequence[str]) -> str | None:
+    accepted: dict[str, float] = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        key, _, value = params.strip().partition("=")
+        if key == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0
+        accepted[name.strip().lower()] = quality
+
+    # Our preference wins over the client's, as long as the client accepts it
+    wildcard = accepted.get("*", 0)
+    for encoding in encodings:
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the preferred encoding the client accepts
+
+    Bodies sent in one message are only compressed from minimum_size bytes.
+    Streamed bodies are always compressed, one flushed chunk per message so
+    nothing is held back from the client.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        encodings: Sequence[str] = ("gzip",),
+        minimum_size: int = 1024,
+        gzip_level: int = 5,
+        brotli_level: int = 4,
+        zstd_level: int = 3,
+    ):
+        self.app = app
+        self.encodings = encodings
+        self.minimum_size = minimum_size
+        self.compressors: dict[str, Callable[[], Compressor]] = {}
+        for encoding in encodings:
+            if encoding == "gzip":
+                self.compressors[encoding] = lambda: GzipCompressor(gzip_level)
+            elif encoding == "br":
+                self.compressors[encoding] = lambda: BrotliCompressor(brotli_level)
+            elif encoding == "zstd":
+                self.compressors[encoding] = lambda: ZstdCompressor(zstd_level)
+            else:
+                raise ValueError(f"Unsupported encoding {encoding}")
+            # Fail at startup if the optional package isn't installed
+            self.compressors[encoding]()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(
+            Headers(scope=scope).get("accept-encoding", ""), self.encodings
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        compressor: Compressor | None = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start = message
+                return
+
+            assert start is not None
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                headers = MutableHeaders(scope=start)
+                if "content-encoding" in headers or (
+                    not more_body and len(body) < self.minimum_size
+                ):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                compressor = self.compressors[encoding]()
+                del headers["content-length"]
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("accept-encoding")
+                if not more_body:
+                    body = compressor.compress(body, final=True)
+                    headers["content-length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+                await send(start)
+
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": compressor.compress(body, final=not more_body),
+                    "more_body": more_body,
+                }
+            )
+
+        await self.app(scope, receive, send_compressed)
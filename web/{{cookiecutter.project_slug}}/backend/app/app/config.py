@@ -1,11 +1,13 @@
 import secrets
 from functools import cached_property
+from typing import Literal
 
 from pydantic import (
     AnyHttpUrl,
     EmailStr,
     FieldValidationInfo,
     PostgresDsn,
+    RedisDsn,
     field_validator,
 )
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -20,6 +22,92 @@ class Settings(BaseSettings):
     secret_key: str = secrets.token_urlsafe(32)
     access_token_expire_minutes: int = 8 * 24 * 60
 
+    # None means one bcrypt worker process per CPU
+    password_hash_workers: int | None = None
+    password_hash_max_concurrency: int = 4
+
+    login_client_per_minute: float = 60
+    login_client_burst: int = 60
+    login_account_per_minute: float = 5
+    login_account_burst: int = 10
+    login_max_pending_verifications: int = 64
+    # Proxies in front of the app that append to X-Forwarded-For, just Traefik by
+    # default. Clients are throttled by the entry this far from the right, which
+    # they can't forge, 0 uses the connecting address
+    login_client_proxy_hops: int = 1
+
+    # Share throttling state between workers, kept in memory per worker if unset
+    throttle_redis_url: RedisDsn | None = None
+
+    @field_validator("throttle_redis_url", mode="before")
+    @classmethod
+    def throttle_redis_url_can_be_blank(cls, v: str) -> str | None:
+        if not v:
+            return None
+
+        return v
+
+    # Writes invalidate the cache in the worker that made them, other workers
+    # may keep serving the previous row for up to user_cache_ttl seconds. Auth
+    # reads it too, so a deactivated or demoted user keeps their access on those
+    # workers for as long. Set to 0 to always read users from the database
+    user_cache_size: int = 10_000
+    user_cache_ttl: float = 60
+    # Exact counts are cleared when this worker creates or deletes users, other
+    # workers may report a stale total for up to this many seconds
+    user_count_cache_ttl: float = 10
+
+    # Encode responses with orjson and serve list endpoints straight from selected
+    # columns, skipping response model validation
+    fast_responses: bool = False
+
+    # Response encodings in order of preference, empty to disable compression.
+    # br needs the brotli package and zstd the zstandard package
+    compression_encodings: list[Literal["zstd", "br", "gzip"]] = ["gzip"]
+    compression_minimum_size: int = 1024
+    # Levels that trade some ratio for much less CPU than the maximums
+    compression_gzip_level: int = 5
+    compression_brotli_level: int = 4
+    compression_zstd_level: int = 3
+
+    # Adds a Server-Timing header to every response, don't enable in production
+    debug: bool = False
+    # Statements slower than this are logged with the route that ran them
+    slow_query_seconds: float = 0.5
+
+    celery_broker_url: str = "amqp://guest@queue//"
+    # Wait for the broker to confirm each published message
+    celery_publish_confirm: bool = True
+    # Seconds to wait on the broker, and for room in the publish buffer once
+    # celery_publish_max_pending messages are waiting to be published
+    celery_publish_timeout: float = 10
+    celery_publish_max_pending: int = 1000
+
+    # Queues this worker consumes. Password resets are routed to high-priority and
+    # batched email to bulk, run bulk on its own worker so it never delays the rest
+    celery_worker_queues: list[str] = ["high-priority", "main-queue", "bulk"]
+    # gevent needs the gevent extra installed, and CELERY_WORKER_POOL set in the
+    # environment rather than .env so the worker can patch before importing this
+    celery_worker_pool: Literal["prefork", "threads", "gevent", "solo"] = "prefork"
+    # None starts one process or thread per CPU
+    celery_worker_concurrency: int | None = None
+    # Tasks reserved ahead per process or thread, more than 1 lets a long task
+    # hold up the ones reserved behind it
+    celery_worker_prefetch_multiplier: int = 1
+    # Acknowledge tasks once they finish so a worker that dies mid task doesn't
+    # lose them, at the cost of a task sometimes running twice
+    celery_task_acks_late: bool = True
+
+    # Tasks the outbox relay publishes per transaction, and how long it waits
+    # for new ones once the outbox is drained
+    outbox_batch_size: int = 100
+    outbox_poll_interval: float = 1
+
+    # Serve Prometheus metrics at /metrics, keep it off the public network. The
+    # outbox relay serves its own on outbox_metrics_port
+    metrics_enabled: bool = False
+    outbox_metrics_port: int = 9100
+
     sentry_dsn: AnyHttpUrl | None = None
 
     @field_validator("sentry_dsn", mode="before")
@@ -30,6 +118,15 @@ class Settings(BaseSettings):
 
         return v
 
+    # Error events are always sent, these only control performance traces
+    sentry_traces_sample_rate: float = 0.1
+    # Per path prefix rates, the longest matching prefix wins
+    sentry_traces_route_rates: dict[str, float] = {}
+    # Scale sample rates down when more transactions than this start per second
+    sentry_traces_target_per_second: float | None = None
+    # Share of sampled transactions that are also profiled
+    sentry_profiles_sample_rate: float = 0.0
+
     postgres_server: str
     postgres_user: str
     postgres_password: str
@@ -47,11 +144,39 @@ class Settings(BaseSettings):
             )
         )
 
+    postgres_pool_size: int = 5
+    postgres_max_overflow: int = 10
+    postgres_pool_timeout: float = 30
+    # Seconds after which connections are replaced, -1 to keep them
+    postgres_pool_recycle: int = -1
+    postgres_pool_pre_ping: bool = False
+    # Prepared statements cached per connection, 0 to disable the cache
+    postgres_statement_cache_size: int = 100
+    # Don't reuse server-side prepared statements, required behind PgBouncer in
+    # transaction pooling mode
+    postgres_pgbouncer: bool = False
+
+    # Read-only sessions are spread over these replicas, with the same database
+    postgres_replica_uris: list[PostgresDsn] = []
+    # Stop reading from replicas further behind the primary, None to ignore lag
+    postgres_replica_max_lag: float | None = None
+    postgres_replica_check_interval: float = 5
+
+    @property
+    def sqlalchemy_replica_uris(self) -> list[str]:
+        return [
+            str(uri).replace(f"{uri.scheme}://", "postgresql+asyncpg://", 1)
+            for uri in self.postgres_replica_uris
+        ]
+
     smtp_tls: bool = True
     smtp_host: str = ""
     smtp_port: int = 0
     smtp_user: str = ""
     smtp_password: str = ""
+    smtp_timeout: float = 10
+    # Each worker thread keeps its SMTP connection open for this many emails
+    smtp_max_messages_per_connection: int = 100
     emails_from_email: EmailStr | None = None
     emails_from_name: str = ""
 
@@ -1 +1,2 @@
+from .crud_outbox import outbox
 from .crud_user import user
@@ -1,64 +1,469 @@
-from typing import Any, Generic, Sequence, TypeVar
+import asyncio
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from typing import Any, Generic, Sequence, TypeVar, overload
 
 from pydantic import BaseModel
-from sqlalchemy import delete, insert, select, update
+from sqlalchemy import (
+    ColumnElement,
+    Float,
+    Integer,
+    Row,
+    Select,
+    and_,
+    any_,
+    column,
+    delete,
+    event,
+    func,
+    literal,
+    or_,
+    select,
+    table,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
+from app.cache import TTLCache
 from app.models import Base
 
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
+T = TypeVar("T")
+
+
+@dataclass
+class Page(Generic[T]):
+    items: Sequence[T]
+    next_cursor: str | None
+
+
+def encode_cursor(key: list[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list[Any]:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid cursor")
+
+    # Every cursor holds at least a sort key name and an id
+    if (
+        not isinstance(key, list)
+        or len(key) < 2
+        or not all(isinstance(value, (int, float, str, type(None))) for value in key)
+    ):
+        raise ValueError("Invalid cursor")
+
+    return key
 
 
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
-    def __init__(self, model: type[ModelType]):
+    # Columns get_all can order by, they should be indexed
+    sortable: tuple[str, ...] = ("id",)
+
+    def __init__(
+        self,
+        model: type[ModelType],
+        cache: TTLCache[int, dict[str, Any]] | None = None,
+        count_cache: TTLCache[str, int] | None = None,
+    ):
         self.model = model
+        self.cache = cache
+        self.count_cache = count_cache
 
-    async def get(self, db: AsyncSession, id: int) -> ModelType | None:
-        return await db.get(self.model, id)
+    @overload
+    async def get(
+        self, db: AsyncSession, id: int, columns: None = None
+    ) -> ModelType | None:
+        ...
 
-    async def get_all(
-        self, db: AsyncSession, skip_id: int = 0, limit: int = 100
+    @overload
+    async def get(
+        self, db: AsyncSession, id: int, columns: Sequence[str]
+    ) -> Row[Any] | None:
+        ...
+
+    async def get(
+        self, db: AsyncSession, id: int, columns: Sequence[str] | None = None
+    ) -> ModelType | Row[Any] | None:
+        if columns is None:
+            return await db.get(self.model, id)
+
+        result = await db.execute(self._select(columns).where(self.model.id == id))
+
+        return result.one_or_none()
+
+    async def get_version(self, db: AsyncSession, id: int) -> int | None:
+        return await db.scalar(select(self.model.version).where(self.model.id == id))
+
+    @overload
+    async def get_many(
+        self, db: AsyncSession, ids: Sequence[int], columns: None = None
     ) -> Sequence[ModelType]:
-        result = await db.scalars(
-            select(self.model).where(self.model.id > skip_id).limit(limit)
-        )
+        ...
 
-        return result.all()
+    @overload
+    async def get_many(
+        self, db: AsyncSession, ids: Sequence[int], columns: Sequence[str]
+    ) -> Sequence[Row[Any]]:
+        ...
+
+    async def get_many(
+        self, db: AsyncSession, ids: Sequence[int], columns: Sequence[str] | None = None
+    ) -> Sequence[ModelType] | Sequence[Row[Any]]:
+        if not ids:
+            return []
+
+        stmt = self._select(columns).where(self._id_in(ids))
+        if columns is not None:
+            return (await db.execute(stmt)).all()
+
+        return (await db.scalars(stmt)).all()
+
+    def _select(self, columns: Sequence[str] | None) -> Select[Any]:
+        # Selecting plain columns returns rows without building ORM instances
+        if columns is None:
+            return select(self.model)
+
+        return select(*(getattr(self.model, column) for column in columns))
+
+    def _id_in(self, ids: Sequence[int]) -> ColumnElement[bool]:
+        # A single array parameter keeps one statement shape for any number of ids
+        return self.model.id == any_(literal(list(ids), ARRAY(Integer)))
+
+    async def load(self, db: AsyncSession, id: int) -> ModelType | None:
+        loader = db.info.get(self)
+        if loader is None:
+            loader = db.info[self] = BatchLoader(self, db)
+
+        return await loader.load(id)
+
+    async def get_cached(self, db: AsyncSession, id: int) -> ModelType | None:
+        if self.cache is None:
+            return await self.get(db, id)
+
+        # Cache column values rather than the instance, which belongs to a session
+        data = self.cache.get(id)
+        if data is not None:
+            return self.model(**data)
+
+        obj = await self.get(db, id)
+        if obj is not None:
+            self.cache.set(
+                id,
+                {
+                    attr.key: getattr(obj, attr.key)
+                    for attr in self.model.__mapper__.column_attrs
+                },
+            )
+
+        return obj
+
+    def invalidate(self, db: AsyncSession, id: int) -> None:
+        if self.cache is None:
+            return
+
+        # Drop the entry again after commit, in case a concurrent request cached
+        # the old row before this transaction became visible
+        self.cache.pop(id)
+        db.info.setdefault("invalidate", []).append((self.cache, id))
+
+    def invalidate_counts(self, db: AsyncSession) -> None:
+        if self.count_cache is None:
+            return
+
+        self.count_cache.clear()
+        db.info.setdefault("clear", []).append(self.count_cache)
+
+    async def count(
+        self,
+        db: AsyncSession,
+        *where: ColumnElement[bool],
+        estimated: bool = False,
+    ) -> int:
+        if estimated:
+            return await self._estimate_count(db, where)
+
+        stmt = select(func.count()).select_from(self.model).where(*where)
+        key = str(stmt.compile(compile_kwargs={"literal_binds": True}))
+        count = self.count_cache.get(key) if self.count_cache is not None else None
+        if count is None:
+            count = await db.scalar(stmt) or 0
+            if self.count_cache is not None:
+                self.count_cache.set(key, count)
+
+        return count
+
+    async def _estimate_count(
+        self, db: AsyncSession, where: Sequence[ColumnElement[bool]]
+    ) -> int:
+        if not where:
+            # Kept up to date by autovacuum, -1 until the table is first analyzed
+            reltuples = await db.scalar(
+                select(column("reltuples", Float))
+                .select_from(table("pg_class"))
+                .where(column("oid") == func.to_regclass(self.model.__tablename__))
+            )
+            if reltuples is not None and reltuples >= 0:
+                return int(reltuples)
+
+            return await self.count(db)
+
+        # Otherwise take the planner's row estimate for the filtered query
+        conn = await db.connection()
+        stmt = select(self.model.id).where(*where)
+        sql = stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")
+        plan = result.scalar_one()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @overload
+    async def get_all(
+        self,
+        db: AsyncSession,
+        cursor: str | None = None,
+        limit: int = 100,
+        order_by: str = "id",
+        columns: None = None,
+    ) -> Page[ModelType]:
+        ...
+
+    @overload
+    async def get_all(
+        self,
+        db: AsyncSession,
+        cursor: str | None = None,
+        limit: int = 100,
+        order_by: str = "id",
+        *,
+        columns: Sequence[str],
+    ) -> Page[Row[Any]]:
+        ...
+
+    async def get_all(
+        self,
+        db: AsyncSession,
+        cursor: str | None = None,
+        limit: int = 100,
+        order_by: str = "id",
+        columns: Sequence[str] | None = None,
+    ) -> Page[ModelType] | Page[Row[Any]]:
+        if order_by not in self.sortable:
+            raise ValueError(f"Can't order by {order_by}")
+
+        # The cursor is built from the last row, so rows always carry its key
+        if columns is not None:
+            columns = [*columns, *(c for c in ("id", order_by) if c not in columns)]
+
+        # Order by the sort column with the id as a tiebreaker, so every row has
+        # a unique position and the next page starts right after the last key
+        stmt = self._select(columns)
+        if order_by == "id":
+            stmt = stmt.order_by(self.model.id)
+        else:
+            column = getattr(self.model, order_by)
+            stmt = stmt.order_by(column.asc().nulls_last(), self.model.id)
+
+        if cursor:
+            key = decode_cursor(cursor)
+            if key[0] != order_by:
+                raise ValueError("Cursor doesn't match the sort order")
+            stmt = stmt.where(self._after(order_by, key[1:]))
+
+        stmt = stmt.limit(limit + 1)
+        items: Sequence[Any]
+        if columns is not None:
+            items = (await db.execute(stmt)).all()
+        else:
+            items = (await db.scalars(stmt)).all()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(self._key(order_by, items[-1]))
+
+        return Page(items, next_cursor)
+
+    def _key(self, order_by: str, obj: ModelType | Row[Any]) -> list[Any]:
+        if order_by == "id":
+            return [order_by, obj.id]
+
+        return [order_by, getattr(obj, order_by), obj.id]
+
+    def _after(self, order_by: str, key: list[Any]) -> ColumnElement[bool]:
+        if order_by == "id":
+            if len(key) != 1 or not isinstance(key[0], int):
+                raise ValueError("Invalid cursor")
+
+            return self.model.id > key[0]
+
+        column = getattr(self.model, order_by)
+        if (
+            len(key) != 2
+            or not isinstance(key[1], int)
+            or not isinstance(key[0], (column.type.python_type, type(None)))
+        ):
+            # A mistyped value would otherwise fail in Postgres, not as a 400
+            raise ValueError("Invalid cursor")
+
+        value, id = key
+        if value is None:
+            return and_(column.is_(None), self.model.id > id)
+
+        # NULLs sort last and never compare greater, so include them explicitly
+        return or_(tuple_(column, self.model.id) > (value, id), column.is_(None))
 
     async def create(
         self, db: AsyncSession, obj_in: CreateSchemaType | dict[str, Any]
-    ) -> ModelType:
+    ) -> ModelType | None:
         if isinstance(obj_in, dict):
             create_data = obj_in
         else:
             create_data = obj_in.model_dump()
 
+        # Returns None when the row conflicts with an existing one, so callers
+        # don't need a separate existence check
         result = await db.scalars(
-            insert(self.model).values(create_data).returning(self.model)
+            pg_insert(self.model)
+            .values(create_data)
+            .on_conflict_do_nothing()
+            .returning(self.model)
         )
+        self.invalidate_counts(db)
 
-        return result.one()
+        return result.one_or_none()
+
+    async def create_many(
+        self,
+        db: AsyncSession,
+        objs_in: Sequence[CreateSchemaType | dict[str, Any]],
+    ) -> Sequence[ModelType]:
+        create_data = [
+            obj_in if isinstance(obj_in, dict) else obj_in.model_dump()
+            for obj_in in objs_in
+        ]
+        if not create_data:
+            return []
+
+        # Sent as multi-row INSERTs, rows that conflict with existing ones are
+        # skipped instead of aborting the batch and left out of the result
+        result = await db.scalars(
+            pg_insert(self.model).on_conflict_do_nothing().returning(self.model),
+            create_data,
+        )
+        self.invalidate_counts(db)
+
+        return result.all()
 
     async def update(
         self, db: AsyncSession, id: int, obj_in: UpdateSchemaType | dict[str, Any]
-    ) -> ModelType:
+    ) -> ModelType | None:
         if isinstance(obj_in, dict):
             update_data = obj_in
         else:
             update_data = obj_in.model_dump(exclude_unset=True)
 
+        # Returns None when no row has this id
         result = await db.scalars(
             update(self.model)
-            .values(update_data)
+            .values({**update_data, "version": self.model.version + 1})
             .where(self.model.id == id)
             .returning(self.model)
         )
+        self.invalidate(db, id)
+        self.invalidate_counts(db)
+
+        return result.one_or_none()
+
+    async def update_many(
+        self,
+        db: AsyncSession,
+        update_data: dict[str, Any],
+        ids: Sequence[int] | None = None,
+        filters: dict[str, Any] | None = None,
+    ) -> Sequence[int]:
+        conditions = [getattr(self.model, k) == v for k, v in (filters or {}).items()]
+        if ids is not None:
+            conditions.append(self._id_in(ids))
+        if not conditions:
+            raise ValueError("Refusing to update every row without a filter")
+
+        result = await db.scalars(
+            update(self.model)
+            .where(*conditions)
+            .values({**update_data, "version": self.model.version + 1})
+            .returning(self.model.id)
+            .execution_options(synchronize_session=False)
+        )
+        updated_ids = result.all()
+        for id in updated_ids:
+            self.invalidate(db, id)
+        self.invalidate_counts(db)
 
-        return result.one()
+        return updated_ids
 
     async def delete(self, db: AsyncSession, id: int) -> bool:
         result = await db.execute(delete(self.model).where(self.model.id == id))
+        self.invalidate(db, id)
+        self.invalidate_counts(db)
 
         return result.rowcount > 0
+
+
+class BatchLoader(Generic[ModelType]):
+    """
+    Coalesce loads issued in the same event loop iteration into one get_many
+    """
+
+    def __init__(self, crud: CRUDBase[ModelType, Any, Any], db: AsyncSession):
+        self.crud = crud
+        self.db = db
+        self._pending: dict[int, asyncio.Future[ModelType | None]] = {}
+        self._task: asyncio.Task[None] | None = None
+
+    def load(self, id: int) -> asyncio.Future[ModelType | None]:
+        future = self._pending.get(id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[id] = loop.create_future()
+            if self._task is None:
+                self._task = loop.create_task(self._dispatch())
+
+        return future
+
+    async def _dispatch(self) -> None:
+        pending, self._pending = self._pending, {}
+        self._task = None
+
+        try:
+            objs = await self.crud.get_many(self.db, list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_id = {obj.id: obj for obj in objs}
+        for id, future in pending.items():
+            if not future.done():
+                future.set_result(by_id.get(id))
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_after_commit(session: Session) -> None:
+    for cache, id in session.info.pop("invalidate", ()):
+        cache.pop(id)
+    for cache in session.info.pop("clear", ()):
+        cache.clear()
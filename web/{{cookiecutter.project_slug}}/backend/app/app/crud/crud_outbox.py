@@ -0,0 +1,40 @@
+from typing import Sequence
+
+from celery import Signature
+from pydantic import BaseModel
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Outbox
+
+from .base import CRUDBase
+
+
+class CRUDOutbox(CRUDBase[Outbox, BaseModel, BaseModel]):
+    def enqueue(self, db: AsyncSession, *signatures: Signature) -> None:
+        # Written in the caller's transaction, so tasks are only published once
+        # the changes that caused them are committed
+        db.add_all(
+            Outbox(task=sig.task, args=list(sig.args), kwargs=dict(sig.kwargs))
+            for sig in signatures
+        )
+
+    async def claim(self, db: AsyncSession, limit: int) -> Sequence[Outbox]:
+        # Rows locked by another relay are skipped, so relays can run side by side
+        claimed = (
+            select(Outbox.id)
+            .order_by(Outbox.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        result = await db.scalars(
+            delete(Outbox)
+            .where(Outbox.id.in_(claimed.scalar_subquery()))
+            .returning(Outbox)
+            .execution_options(synchronize_session=False)
+        )
+
+        return result.all()
+
+
+outbox = CRUDOutbox(Outbox)
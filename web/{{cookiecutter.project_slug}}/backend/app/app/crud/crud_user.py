@@ -1,43 +1,119 @@
-from typing import Any
+from typing import Any, Sequence
 
-from sqlalchemy import select
+from sqlalchemy import ColumnElement, and_, func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.auth import get_password_hash, verify_password
+from app.cache import TTLCache
+from app.config import settings
+from app.hashing import hasher
 from app.models import User
 from app.schemas import UserCreate, UserUpdate
 
-from .base import CRUDBase
+from .base import CRUDBase, Page, decode_cursor, encode_cursor
 
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
+    sortable = ("id", "email", "full_name")
+
     async def get_by_email(self, db: AsyncSession, email: str) -> User | None:
         result = await db.scalars(select(User).where(User.email == email))
 
         return result.first()
 
+    def search_filter(self, q: str, prefix: bool = False) -> ColumnElement[bool]:
+        # Match the query literally, backslash is the default LIKE escape
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"{escaped}%" if prefix else f"%{escaped}%"
+
+        # Both ILIKEs are served by the trigram indexes
+        return or_(User.full_name.ilike(pattern), User.email.ilike(pattern))
+
+    async def search(
+        self,
+        db: AsyncSession,
+        q: str,
+        prefix: bool = False,
+        cursor: str | None = None,
+        limit: int = 100,
+    ) -> Page[User]:
+        # The rank only has to be computed for the rows that match
+        rank = func.greatest(
+            func.word_similarity(q, User.full_name), func.word_similarity(q, User.email)
+        ).label("rank")
+        stmt = (
+            select(User, rank)
+            .where(self.search_filter(q, prefix))
+            .order_by(rank.desc(), User.id)
+        )
+
+        if cursor:
+            key = decode_cursor(cursor)
+            if (
+                len(key) != 3
+                or key[0] != "rank"
+                or not isinstance(key[1], (int, float))
+                or not isinstance(key[2], int)
+            ):
+                raise ValueError("Invalid cursor")
+            _, last_rank, last_id = key
+            stmt = stmt.where(
+                or_(rank < last_rank, and_(rank == last_rank, User.id > last_id))
+            )
+
+        result = await db.execute(stmt.limit(limit + 1))
+        rows = result.all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(["rank", rows[-1].rank, rows[-1].User.id])
+
+        return Page([row.User for row in rows], next_cursor)
+
     async def create(
         self, db: AsyncSession, obj_in: UserCreate | dict[str, Any]
-    ) -> User:
+    ) -> User | None:
         if isinstance(obj_in, dict):
             create_data = obj_in
         else:
             create_data = obj_in.model_dump()
 
-        create_data["hashed_password"] = get_password_hash(create_data.pop("password"))
+        # An indexed lookup is far cheaper than bcrypt, so duplicate signups don't
+        # get to hash. The insert still skips rows created since
+        exists = await db.scalar(
+            select(User.id).where(User.email == create_data["email"])
+        )
+        if exists is not None:
+            return None
+
+        create_data["hashed_password"] = await hasher.hash(create_data.pop("password"))
 
         return await super().create(db, create_data)
 
+    async def create_many(
+        self, db: AsyncSession, objs_in: Sequence[UserCreate | dict[str, Any]]
+    ) -> Sequence[User]:
+        create_data = [
+            dict(obj_in) if isinstance(obj_in, dict) else obj_in.model_dump()
+            for obj_in in objs_in
+        ]
+
+        hashes = await hasher.hash_many([data.pop("password") for data in create_data])
+        for data, hashed_password in zip(create_data, hashes):
+            data["hashed_password"] = hashed_password
+
+        return await super().create_many(db, create_data)
+
     async def update(
         self, db: AsyncSession, id: int, obj_in: UserUpdate | dict[str, Any]
-    ) -> User:
+    ) -> User | None:
         if isinstance(obj_in, dict):
             update_data = obj_in
         else:
             update_data = obj_in.model_dump(exclude_unset=True)
 
         if "password" in update_data:
-            update_data["hashed_password"] = get_password_hash(
+            update_data["hashed_password"] = await hasher.hash(
                 update_data.pop("password")
             )
 
@@ -47,10 +123,14 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         self, db: AsyncSession, email: str, password: str
     ) -> User | None:
         user = await self.get_by_email(db, email)
-        if user and verify_password(password, user.hashed_password):
+        if user and await hasher.verify(password, user.hashed_password):
             return user
 
         return None
 
 
-user = CRUDUser(User)
+user = CRUDUser(
+    User,
+    cache=TTLCache(settings.user_cache_size, settings.user_cache_ttl),
+    count_cache=TTLCache(1000, settings.user_count_cache_ttl),
+)
@@ -1,12 +1,169 @@
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+import asyncio
+import logging
+import math
+import random
+import time
+from contextvars import ContextVar
+from typing import Any
+from uuid import uuid4
+
+from sqlalchemy import Connection, Engine, event, text
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import ORMExecuteState, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
 
 from app import crud, schemas
 from app.config import settings
 
-engine = create_async_engine(settings.sqlalchemy_database_uri)
+logger = logging.getLogger(__name__)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that also records how long checkouts wait for a connection, including
+    checkouts that are served immediately
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.checkout_count = 0
+        self.checkout_seconds = 0.0
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.checkout_count += 1
+            self.checkout_seconds += time.perf_counter() - start
+
+
+def engine_options() -> dict[str, Any]:
+    connect_args: dict[str, Any] = {
+        "prepared_statement_cache_size": settings.postgres_statement_cache_size
+    }
+    if settings.postgres_pgbouncer:
+        # PgBouncer may run each statement on a different server connection,
+        # so never reuse a prepared statement and give each a unique name
+        connect_args = {
+            "prepared_statement_cache_size": 0,
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": settings.postgres_pool_size,
+        "max_overflow": settings.postgres_max_overflow,
+        "pool_timeout": settings.postgres_pool_timeout,
+        "pool_recycle": settings.postgres_pool_recycle,
+        "pool_pre_ping": settings.postgres_pool_pre_ping,
+        "connect_args": connect_args,
+    }
+
+
+def pool_stats(engine: AsyncEngine) -> dict[str, float]:
+    pool = engine.pool
+    assert isinstance(pool, TimedQueuePool)
+
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "checkout_count": pool.checkout_count,
+        "checkout_seconds": pool.checkout_seconds,
+    }
+
+
+engine = create_async_engine(settings.sqlalchemy_database_uri, **engine_options())
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_async_engine(url, **engine_options())
+        self.read_engine = self.engine.execution_options(isolation_level="AUTOCOMMIT")
+        self.lag = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        if settings.postgres_replica_max_lag is None:
+            return self.lag < math.inf
+
+        return self.lag <= settings.postgres_replica_max_lag
+
+    async def check(self) -> None:
+        # Replay lag also grows while the primary is idle, which only means
+        # reads fall back to the primary until the next write replicates
+        try:
+            async with self.engine.connect() as conn:
+                self.lag = await conn.scalar(
+                    text(
+                        "SELECT COALESCE(EXTRACT(EPOCH FROM"
+                        " now() - pg_last_xact_replay_timestamp()), 0)"
+                    )
+                )
+        except Exception:
+            logger.exception("Replica check failed")
+            self.lag = math.inf
+
+
+replicas = [Replica(url) for url in settings.sqlalchemy_replica_uris]
+
+# Set once a request writes, so its later reads see its own writes
+primary_pinned: ContextVar[bool] = ContextVar("primary_pinned", default=False)
+
+
+async def monitor_replicas() -> None:
+    while True:
+        await asyncio.gather(*(replica.check() for replica in replicas))
+        await asyncio.sleep(settings.postgres_replica_check_interval)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def pin_primary_after_write(orm_execute_state: ORMExecuteState) -> None:
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        primary_pinned.set(True)
+
+
+class ReadOnlySession(Session):
+    def get_bind(self, *args: Any, **kwargs: Any) -> Engine | Connection:
+        if replicas and not primary_pinned.get():
+            healthy = [replica for replica in replicas if replica.healthy]
+            if healthy:
+                return random.choice(healthy).read_engine.sync_engine
+
+        return super().get_bind(*args, **kwargs)
+
+
+# Autocommit skips the BEGIN and COMMIT round trips around each request's reads
+read_session = async_sessionmaker(
+    engine.execution_options(isolation_level="AUTOCOMMIT"),
+    expire_on_commit=False,
+    sync_session_class=ReadOnlySession,
+)
+
+
+@event.listens_for(ReadOnlySession, "do_orm_execute")
+def reject_writes(orm_execute_state: ORMExecuteState) -> None:
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        raise RuntimeError("Can't write through a read-only session")
+
+
 async def init_db(db: AsyncSession) -> None:
     # Tables should be created with Alembic migrations
     # But if you don't want to use migrations, create
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any
+
+from celery import Celery
+from kombu import Producer
+
+Message = tuple[str, list[Any], dict[str, Any]]
+
+
+class TaskDispatcher:
+    """
+    Publish tasks from a thread of their own that keeps one producer, and so one
+    broker connection, open between calls, so publishing never blocks the event loop
+    """
+
+    def __init__(
+        self, app: Celery, max_pending: int, timeout: float, confirm: bool = True
+    ):
+        self.app = app
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.confirm = confirm
+        # A single thread publishes in order and owns the producer, kombu
+        # connections aren't safe to share between threads
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="dispatch")
+        self._slots = asyncio.Semaphore(max_pending)
+        self._producer: Producer | None = None
+
+        self.waiting = 0
+        self.pending = 0
+        self.published = 0
+        self.failed = 0
+        # Seconds from send() being called until the broker took the message
+        self.seconds = 0.0
+
+    def _publish(self, message: Message) -> None:
+        if self._producer is None:
+            # Kept open between messages, kombu reconnects it when the connection
+            # drops. Timeouts also bound the wait for a publisher confirm
+            connection = self.app.connection_for_write(
+                connect_timeout=self.timeout,
+                transport_options={
+                    "confirm_publish": self.confirm,
+                    "read_timeout": self.timeout,
+                    "write_timeout": self.timeout,
+                },
+            )
+            self._producer = self.app.amqp.Producer(connection, auto_declare=False)
+
+        task, args, kwargs = message
+        try:
+            self.app.send_task(task, args=args, kwargs=kwargs, producer=self._producer)
+        except Exception:
+            # Start over on a fresh connection in case the channel is unusable
+            self._close()
+            raise
+
+    async def _acquire(self) -> None:
+        self.waiting += 1
+        try:
+            # Callers wait once max_pending messages are queued for the thread,
+            # and fail if the broker doesn't catch up in time
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        finally:
+            self.waiting -= 1
+
+    def _done(self, start: float, future: asyncio.Future[None]) -> None:
+        self.seconds += time.perf_counter() - start
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+        else:
+            self.published += 1
+        self.pending -= 1
+        self._slots.release()
+
+    async def send(self, *messages: Message) -> None:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for message in messages:
+            start = time.perf_counter()
+            await self._acquire()
+            self.pending += 1
+            future = loop.run_in_executor(self._executor, self._publish, message)
+            future.add_done_callback(partial(self._done, start))
+            futures.append(future)
+
+        await asyncio.gather(*futures)
+
+    def _close(self) -> None:
+        if self._producer is not None:
+            self._producer.connection.close()
+            self._producer = None
+
+    def shutdown(self) -> None:
+        self._executor.submit(self._close)
+        self._executor.shutdown()
@@ -0,0 +1,67 @@
+import codecs
+import csv
+import io
+import json
+from collections.abc import AsyncIterator, Iterable, Mapping, Sequence
+from typing import Any
+
+
+def encode_ndjson(rows: Iterable[Mapping[Any, Any]]) -> bytes:
+    return "".join(
+        json.dumps(dict(row), separators=(",", ":")) + "\n" for row in rows
+    ).encode()
+
+
+def encode_csv(rows: Iterable[Sequence[Any]]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+
+    return buffer.getvalue().encode()
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Keeps a character split across chunks until the rest of it arrives
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def decode_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[Any]:
+    async for line in lines:
+        if not line.strip():
+            continue
+
+        # Yield None for malformed lines so callers can report them per row
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+async def decode_csv(lines: AsyncIterator[str]) -> AsyncIterator[dict[str, str]]:
+    header: list[str] | None = None
+    record = ""
+    async for line in lines:
+        # A quoted field may contain newlines, keep reading until quotes balance
+        record += line
+        if record.count('"') % 2:
+            record += "\n"
+            continue
+
+        values: list[str] = next(csv.reader([record]), [])
+        record = ""
+        if not values:
+            continue
+
+        if header is None:
+            header = values
+        else:
+            yield dict(zip(header, values))
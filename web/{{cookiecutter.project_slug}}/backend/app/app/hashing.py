@@ -0,0 +1,88 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from app import auth, timing
+from app.config import settings
+
+T = TypeVar("T")
+
+
+class PasswordHasher:
+    """
+    Run bcrypt in a process pool so that hashing never blocks the event loop
+    """
+
+    def __init__(self, max_workers: int | None = None, max_concurrency: int = 4):
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self._executor: ProcessPoolExecutor | None = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        self.queue_depth = 0
+        self.in_flight = 0
+        # Calls and seconds spent per operation, keyed by "hash" and "verify"
+        self.counts = {"hash": 0, "verify": 0}
+        self.seconds = {"hash": 0.0, "verify": 0.0}
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawn instead of fork so children don't inherit the running
+            # event loop and open database connections
+            self._executor = ProcessPoolExecutor(
+                self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+        return self._executor
+
+    async def _run(self, op: str, fn: Callable[..., T], *args: Any) -> T:
+        self.queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[op] += elapsed
+            timing.record("hash", elapsed)
+            self.counts[op] += 1
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", auth.get_password_hash, password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        # Hash in waves no wider than the concurrency cap, so a bulk job never
+        # queues more work than the pool runs at once
+        hashes: list[str] = []
+        for i in range(0, len(passwords), self.max_concurrency):
+            hashes += await asyncio.gather(
+                *map(self.hash, passwords[i : i + self.max_concurrency])
+            )
+
+        return hashes
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(
+            "verify", auth.verify_password, plain_password, hashed_password
+        )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+hasher = PasswordHasher(
+    settings.password_hash_workers, settings.password_hash_max_concurrency
+)
@@ -1,20 +1,45 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
 
 from app.api import api_v1
 from app.config import settings
+from app.db import engine, monitor_replicas, replicas
+from app.hashing import hasher
+from app.timing import TimingMiddleware, instrument
 
 if settings.sentry_dsn:
     import sentry_sdk
 
+    from app.tracing import traces_sampler
+
     sentry_sdk.init(
         dsn=str(settings.sentry_dsn),
-        # Set traces_sample_rate to 1.0 to capture 100%
-        # of transactions for performance monitoring.
-        traces_sample_rate=1.0,
+        traces_sampler=traces_sampler,
+        profiles_sample_rate=settings.sentry_profiles_sample_rate,
     )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    if replicas:
+        monitor = asyncio.create_task(monitor_replicas())
+
+    yield
+
+    if replicas:
+        monitor.cancel()
+    hasher.shutdown()
+
+
 app = FastAPI(
-    title=settings.project_name, openapi_url=f"{settings.api_v1_str}/openapi.json"
+    title=settings.project_name,
+    openapi_url=f"{settings.api_v1_str}/openapi.json",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if settings.fast_responses else JSONResponse,
 )
 
 if settings.cors_origins:
@@ -26,6 +51,29 @@ if settings.cors_origins:
         allow_methods=["*"],
         allow_headers=["*"],
         allow_credentials=True,
+        expose_headers=["X-Next-Cursor", "X-Total-Count"],
     )
 
 app.include_router(api_v1.router, prefix=settings.api_v1_str)
+
+for instrumented in [engine, *(replica.engine for replica in replicas)]:
+    instrument(instrumented)
+app.add_middleware(TimingMiddleware)
+
+if settings.compression_encodings:
+    from app.compression import CompressionMiddleware
+
+    app.add_middleware(
+        CompressionMiddleware,
+        encodings=settings.compression_encodings,
+        minimum_size=settings.compression_minimum_size,
+        gzip_level=settings.compression_gzip_level,
+        brotli_level=settings.compression_brotli_level,
+        zstd_level=settings.compression_zstd_level,
+    )
+
+if settings.metrics_enabled:
+    from app.metrics import MetricsMiddleware, metrics
+
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics, include_in_schema=False)
@@ -0,0 +1,106 @@
+import time
+from bisect import bisect_left
+from collections.abc import Iterator
+
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.db import engine, pool_stats
+from app.hashing import hasher
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    Cumulative buckets are only computed when rendering, so observing is a bisect
+    and two increments without any locking, which is safe on the event loop thread
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str) -> Iterator[str]:
+        sep = "," if labels else ""
+        total = 0
+        for le, count in zip(self.buckets, self.counts):
+            total += count
+            yield f'{name}_bucket{{{labels}{sep}le="{le}"}} {total}'
+        total += self.counts[-1]
+        yield f'{name}_bucket{{{labels}{sep}le="+Inf"}} {total}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {total}"
+
+
+requests_in_flight = 0
+request_latency: dict[tuple[str, str], Histogram] = {}
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global requests_in_flight
+        requests_in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            requests_in_flight -= 1
+            # Label by route template so path parameters don't explode the number
+            # of series, requests that match no route are grouped together
+            route = scope.get("route")
+            key = (scope["method"], route.path if route else "unmatched")
+            histogram = request_latency.get(key)
+            if histogram is None:
+                histogram = request_latency[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(time.perf_counter() - start)
+
+
+def render() -> Iterator[str]:
+    yield "# TYPE http_requests_in_flight gauge"
+    yield f"http_requests_in_flight {requests_in_flight}"
+
+    yield "# TYPE http_request_duration_seconds histogram"
+    for (method, path), histogram in list(request_latency.items()):
+        yield from histogram.render(
+            "http_request_duration_seconds", f'method="{method}",route="{path}"'
+        )
+
+    stats = pool_stats(engine)
+    for name in ("size", "checked_out", "idle", "overflow"):
+        yield f"# TYPE db_pool_{name} gauge"
+        yield f"db_pool_{name} {stats[name]}"
+    yield "# TYPE db_pool_checkouts_total counter"
+    yield f"db_pool_checkouts_total {stats['checkout_count']}"
+    yield "# TYPE db_pool_checkout_seconds_total counter"
+    yield f"db_pool_checkout_seconds_total {stats['checkout_seconds']}"
+
+    yield "# TYPE password_hash_queue_depth gauge"
+    yield f"password_hash_queue_depth {hasher.queue_depth}"
+    yield "# TYPE password_hash_in_flight gauge"
+    yield f"password_hash_in_flight {hasher.in_flight}"
+    yield "# TYPE password_hash_operations_total counter"
+    for op, count in hasher.counts.items():
+        yield f'password_hash_operations_total{{op="{op}"}} {count}'
+    yield "# TYPE password_hash_seconds_total counter"
+    for op, seconds in hasher.seconds.items():
+        yield f'password_hash_seconds_total{{op="{op}"}} {seconds}'
+
+
+async def metrics(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(
+        "\n".join(render()) + "\n", media_type="text/plain; version=0.0.4"
+    )
@@ -1,2 +1,3 @@
 from .base import Base
+from .outbox import Outbox
 from .user import User
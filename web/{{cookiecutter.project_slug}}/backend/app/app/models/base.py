@@ -1,11 +1,13 @@
 import re
 
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, declared_attr, mapped_column
 
 
 class Base(DeclarativeBase):
     id: Mapped[int] = mapped_column(primary_key=True)
+    # Bumped by every CRUD update, clients use it to tell whether a row changed
+    version: Mapped[int] = mapped_column(default=1, server_default=text("1"))
 
     metadata = MetaData(
         naming_convention={
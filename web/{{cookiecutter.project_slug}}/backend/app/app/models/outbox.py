@@ -0,0 +1,15 @@
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class Outbox(Base):
+    task: Mapped[str]
+    args: Mapped[list[Any]] = mapped_column(JSONB)
+    kwargs: Mapped[dict[str, Any]] = mapped_column(JSONB)
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from collections.abc import Iterator
+
+from app import crud
+from app.celery import app as celery_app
+from app.config import settings
+from app.db import async_session
+from app.dispatch import TaskDispatcher
+
+logger = logging.getLogger(__name__)
+
+# Only the relay publishes, so only its process opens a broker connection
+dispatcher = TaskDispatcher(
+    celery_app,
+    settings.celery_publish_max_pending,
+    settings.celery_publish_timeout,
+    settings.celery_publish_confirm,
+)
+
+
+async def relay_batch() -> int:
+    async with async_session.begin() as db:
+        claimed = await crud.outbox.claim(db, settings.outbox_batch_size)
+        if claimed:
+            # Publish before the claim commits, so a failed publish rolls the rows
+            # back for the next attempt. Delivery is at least once
+            await dispatcher.send(
+                *((row.task, row.args, row.kwargs) for row in claimed)
+            )
+
+    return len(claimed)
+
+
+async def relay() -> None:
+    while True:
+        try:
+            count = await relay_batch()
+        except Exception:
+            logger.exception("Relaying outbox tasks failed")
+            count = 0
+
+        # Keep draining while batches come back full
+        if count < settings.outbox_batch_size:
+            await asyncio.sleep(settings.outbox_poll_interval)
+
+
+def render() -> Iterator[str]:
+    yield "# TYPE celery_dispatch_waiting gauge"
+    yield f"celery_dispatch_waiting {dispatcher.waiting}"
+    yield "# TYPE celery_dispatch_pending gauge"
+    yield f"celery_dispatch_pending {dispatcher.pending}"
+    yield "# TYPE celery_dispatch_messages_total counter"
+    yield f'celery_dispatch_messages_total{{result="published"}} {dispatcher.published}'
+    yield f'celery_dispatch_messages_total{{result="failed"}} {dispatcher.failed}'
+    yield "# TYPE celery_dispatch_seconds_total counter"
+    yield f"celery_dispatch_seconds_total {dispatcher.seconds}"
+
+
+async def metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # Any request gets the metrics, the relay serves nothing else
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        writer.close()
+        return
+
+    body = ("\n".join(render()) + "\n").encode()
+    writer.write(
+        b"HTTP/1.1 200 OK\r\n"
+        b"Content-Type: text/plain; version=0.0.4\r\n"
+        b"Content-Length: %d\r\n"
+        b"Connection: close\r\n\r\n" % len(body) + body
+    )
+    await writer.drain()
+    writer.close()
+
+
+async def main() -> None:
+    if not settings.metrics_enabled:
+        await relay()
+        return
+
+    async with await asyncio.start_server(metrics, port=settings.outbox_metrics_port):
+        await relay()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    finally:
+        dispatcher.shutdown()
@@ -1,3 +1,13 @@
 from .msg import Msg
 from .token import Token, TokenData
-from .user import User, UserCreate, UserInDB, UserUpdate
+from .user import (
+    User,
+    UserBulkUpdate,
+    UserBulkUpdateResult,
+    UserCreate,
+    UserFilter,
+    UserImportError,
+    UserImportResult,
+    UserInDB,
+    UserUpdate,
+)
@@ -29,3 +29,30 @@ class User(UserInDBBase):
 
 class UserInDB(UserInDBBase):
     hashed_password: str
+
+
+class UserFilter(BaseModel):
+    ids: list[int] | None = None
+    is_active: bool | None = None
+    is_superuser: bool | None = None
+
+
+class UserBulkUpdate(BaseModel):
+    filter: UserFilter
+    is_active: bool | None = None
+    is_superuser: bool | None = None
+
+
+class UserBulkUpdateResult(BaseModel):
+    count: int
+
+
+class UserImportError(BaseModel):
+    row: int
+    email: str | None = None
+    detail: str
+
+
+class UserImportResult(BaseModel):
+    created: int = 0
+    errors: list[UserImportError] = []
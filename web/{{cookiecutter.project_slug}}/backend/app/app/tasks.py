@@ -1,37 +1,74 @@
+from datetime import timedelta
+from typing import Any
+
 from celery import shared_task
 from jinja2 import Environment, PackageLoader, select_autoescape
 
-from app import utils
+from app import auth, utils
 from app.config import settings
+from app.schemas import TokenData
 
 env = Environment(autoescape=select_autoescape(), loader=PackageLoader("app"))
 
 
-@shared_task
-def send_new_account_email(to: str, username: str, password: str) -> None:
+def reset_password_link(user_id: int) -> str:
+    # Tokens are created here rather than passed in, so the outbox never stores
+    # credentials
+    token = auth.create_access_token(
+        TokenData(user_id=user_id),
+        expires_delta=timedelta(hours=settings.email_reset_token_expire_hours),
+    )
+
+    return f"{settings.server_host}/reset-password?token={token}"
+
+
+def new_account_email(to: str, username: str, user_id: int) -> dict[str, Any]:
     template = env.get_template("new_account.html")
 
-    utils.send_email(
+    return dict(
         mail_to=to,
         subject=f"{settings.project_name} - New account for user {username}",
         html=template.render(
-            link=settings.server_host,
+            link=reset_password_link(user_id),
             project_name=settings.project_name,
             username=username,
-            password=password,
+            valid_hours=settings.email_reset_token_expire_hours,
         ),
     )
 
 
 @shared_task
-def send_reset_password_email(to: str, username: str, token: str) -> None:
+def send_new_account_email(to: str, username: str, user_id: int) -> None:
+    utils.send_email(**new_account_email(to, username, user_id))
+
+
+@shared_task
+def send_new_account_emails(accounts: list[dict[str, Any]]) -> dict[str, str]:
+    # Sent over the worker thread's pooled SMTP connection. A failed email is reported
+    # rather than raised, so a retry wouldn't send the others twice
+    failed = {}
+    for account in accounts:
+        try:
+            response = utils.send_email(**new_account_email(**account))
+        except Exception as e:
+            failed[account["to"]] = str(e)
+            continue
+
+        if not response.success:
+            failed[account["to"]] = str(response.error)
+
+    return failed
+
+
+@shared_task
+def send_reset_password_email(to: str, username: str, user_id: int) -> None:
     template = env.get_template("reset_password.html")
 
     utils.send_email(
         mail_to=to,
         subject=f"{settings.project_name} - Password recovery for user {username}",
         html=template.render(
-            link=f"{settings.server_host}/reset-password?token={token}",
+            link=reset_password_link(user_id),
             project_name=settings.project_name,
             username=username,
             valid_hours=settings.email_reset_token_expire_hours,
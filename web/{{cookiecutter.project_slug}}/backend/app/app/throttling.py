@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict
+from typing import Protocol
+
+from app.config import settings
+
+
+class BucketStore(Protocol):
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """
+        Take a token from the bucket, returning the seconds to wait if it's empty
+        """
+        ...
+
+
+class MemoryBucketStore:
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+        return 0.0
+
+
+# Floats are truncated to integers in Redis replies, so return the wait as a string
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+else
+    tokens = tokens - 1
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate))
+return tostring(wait)
+"""
+
+
+class RedisBucketStore:
+    def __init__(self, url: str):
+        from redis.asyncio import Redis
+
+        self._redis = Redis.from_url(url)
+        self._take = self._redis.register_script(TAKE_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        return float(await self._take(keys=[key], args=[rate, burst]))
+
+
+class RateLimiter:
+    def __init__(self, store: BucketStore, prefix: str, per_minute: float, burst: int):
+        self.store = store
+        self.prefix = prefix
+        self.rate = per_minute / 60
+        self.burst = burst
+
+    async def hit(self, key: str) -> float:
+        return await self.store.take(f"{self.prefix}:{key}", self.rate, self.burst)
+
+
+store: BucketStore
+if settings.throttle_redis_url:
+    store = RedisBucketStore(str(settings.throttle_redis_url))
+else:
+    store = MemoryBucketStore()
+
+login_client_limiter = RateLimiter(
+    store,
+    "login:client",
+    settings.login_client_per_minute,
+    settings.login_client_burst,
+)
+login_account_limiter = RateLimiter(
+    store,
+    "login:account",
+    settings.login_account_per_minute,
+    settings.login_account_burst,
+)
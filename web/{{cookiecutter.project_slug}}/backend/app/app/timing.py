@@ -0,0 +1,113 @@
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimings:
+    def __init__(self, scope: Scope):
+        self.scope = scope
+        self.start = time.perf_counter()
+        self.queries = 0
+        # Seconds spent per subsystem, keyed by Server-Timing metric name
+        self.seconds = {"db": 0.0, "hash": 0.0}
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return route.path if route else self.scope["path"]
+
+    def server_timing(self) -> str:
+        total = (time.perf_counter() - self.start) * 1000
+        metrics = [f"{name};dur={s * 1000:.1f}" for name, s in self.seconds.items()]
+        metrics[0] += f';desc="{self.queries} queries"'
+
+        return ", ".join([*metrics, f"total;dur={total:.1f}"])
+
+
+request_timings: ContextVar[RequestTimings | None] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def record(name: str, seconds: float) -> None:
+    timings = request_timings.get()
+    if timings is not None:
+        timings.seconds[name] += seconds
+
+
+def before_cursor_execute(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    *args: Any,
+) -> None:
+    # Kept on the statement's context rather than the connection, so a statement
+    # that raises leaves nothing behind
+    context._query_start = time.perf_counter()
+
+
+def after_cursor_execute(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    *args: Any,
+) -> None:
+    elapsed = time.perf_counter() - context._query_start
+
+    timings = request_timings.get()
+    if timings is not None:
+        timings.queries += 1
+        timings.seconds["db"] += elapsed
+
+    if elapsed >= settings.slow_query_seconds:
+        logger.warning(
+            "Slow query (%.3fs) in %s: %s",
+            elapsed,
+            timings.route if timings else "background",
+            statement,
+        )
+
+
+def instrument(engine: AsyncEngine) -> None:
+    # Engines derived with execution_options() share these listeners
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+class TimingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(scope)
+        token = request_timings.set(timings)
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing if settings.debug else send)
+        finally:
+            request_timings.reset(token)
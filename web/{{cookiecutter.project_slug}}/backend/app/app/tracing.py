@@ -0,0 +1,66 @@
+import time
+from typing import Any
+
+from app.config import settings
+
+
+class TracesSampler:
+    """
+    Pick a trace sample rate by the longest matching path prefix, then scale it
+    down once throughput exceeds target_per_second so the volume of traces stays
+    roughly flat under load
+    """
+
+    def __init__(
+        self,
+        default_rate: float,
+        route_rates: dict[str, float],
+        target_per_second: float | None = None,
+        window: float = 10,
+    ):
+        self.default_rate = default_rate
+        self.route_rates = sorted(route_rates.items(), key=lambda i: -len(i[0]))
+        self.target_per_second = target_per_second
+        self.window = window
+
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._scale = 1.0
+
+    def rate(self, path: str) -> float:
+        for prefix, rate in self.route_rates:
+            if path.startswith(prefix):
+                return rate
+
+        return self.default_rate
+
+    def scale(self) -> float:
+        if self.target_per_second is None:
+            return 1.0
+
+        # Throughput of the last full window decides the scale for the next one
+        self._window_count += 1
+        elapsed = time.monotonic() - self._window_start
+        if elapsed >= self.window:
+            per_second = self._window_count / elapsed
+            self._scale = min(1.0, self.target_per_second / per_second)
+            self._window_start += elapsed
+            self._window_count = 0
+
+        return self._scale
+
+    def __call__(self, sampling_context: dict[str, Any]) -> float:
+        # Follow the decision of an upstream service to keep traces complete
+        parent_sampled = sampling_context.get("parent_sampled")
+        if parent_sampled is not None:
+            return float(parent_sampled)
+
+        scope = sampling_context.get("asgi_scope") or {}
+        return self.rate(scope.get("path", "")) * self.scale()
+
+
+traces_sampler = TracesSampler(
+    settings.sentry_traces_sample_rate,
+    settings.sentry_traces_route_rates,
+    settings.sentry_traces_target_per_second,
+)
@@ -1,19 +1,63 @@
+import logging
+import threading
+
 import emails
+from emails.backend import SMTPBackend
 
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def get_smtp() -> SMTPBackend:
+    # One connection per worker thread, kept open between emails so each one
+    # doesn't pay for the TLS handshake and AUTH again
+    smtp = getattr(_local, "smtp", None)
+    if smtp is None:
+        smtp = _local.smtp = SMTPBackend(
+            tls=settings.smtp_tls,
+            host=settings.smtp_host,
+            port=settings.smtp_port,
+            user=settings.smtp_user,
+            password=settings.smtp_password,
+            timeout=settings.smtp_timeout,
+        )
+        _local.sent = 0
+
+    return smtp
+
+
+def close_smtp() -> None:
+    smtp = getattr(_local, "smtp", None)
+    if smtp is not None:
+        smtp.close()
+        _local.smtp = None
+
 
 def send_email(**kwargs):
     m = emails.Message(
         mail_from=(settings.emails_from_name, settings.emails_from_email), **kwargs
     )
 
-    return m.send(
-        smtp={
-            "tls": settings.smtp_tls,
-            "host": settings.smtp_host,
-            "port": settings.smtp_port,
-            "user": settings.smtp_user,
-            "password": settings.smtp_password,
-        }
-    )
+    smtp = get_smtp()
+    try:
+        # A connection the server dropped while idle is reopened once by the backend
+        response = m.send(smtp=smtp)
+    except Exception:
+        # Reconnect for the next email rather than reuse a broken session
+        close_smtp()
+        raise
+
+    # Servers cap the messages accepted per session
+    _local.sent += 1
+    if _local.sent >= settings.smtp_max_messages_per_connection:
+        close_smtp()
+
+    if not response.success:
+        logger.warning(
+            "Sending email to %s failed: %s", kwargs.get("mail_to"), response.error
+        )
+
+    return response
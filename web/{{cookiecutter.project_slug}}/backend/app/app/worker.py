@@ -0,0 +1,30 @@
+import os
+
+# gevent has to patch the standard library before anything else imports it, so
+# the pool is read straight from the environment ahead of the settings
+if os.environ.get("CELERY_WORKER_POOL") == "gevent":
+    from gevent import monkey
+
+    monkey.patch_all()
+
+from app.celery import app  # noqa: E402
+from app.config import settings  # noqa: E402
+
+if __name__ == "__main__":
+    if settings.celery_worker_pool == "gevent":
+        from gevent import monkey
+
+        # Set only in .env the pool would run unpatched, blocking on each task
+        if not monkey.is_module_patched("socket"):
+            raise RuntimeError(
+                "CELERY_WORKER_POOL=gevent must be set in the environment"
+            )
+
+    app.worker_main(
+        [
+            "worker",
+            "--loglevel=info",
+            f"--queues={','.join(settings.celery_worker_queues)}",
+            f"--pool={settings.celery_worker_pool}",
+        ]
+    )
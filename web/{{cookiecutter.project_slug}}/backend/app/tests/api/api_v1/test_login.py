@@ -0,0 +1,51 @@
+import pytest
+from httpx import AsyncClient
+from starlette.requests import Request
+
+from app import crud
+from app.api import deps
+from app.config import settings
+from app.db import async_session
+from app.tasks import send_reset_password_email
+
+# This is the same as using the @pytest.mark.anyio on all test functions in the module
+pytestmark = pytest.mark.anyio
+
+
+async def test_login_throttled_per_account(client: AsyncClient) -> None:
+    data = {"username": "throttled@example.com", "password": "wrong"}
+
+    for _ in range(settings.login_account_burst):
+        r = await client.post(f"{settings.api_v1_str}/login/access-token", data=data)
+        assert r.status_code == 400
+
+    r = await client.post(f"{settings.api_v1_str}/login/access-token", data=data)
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) > 0
+
+
+def test_client_host_ignores_spoofed_forwarded_for() -> None:
+    def client_host(forwarded_for: str) -> str:
+        headers = [(b"x-forwarded-for", forwarded_for.encode())]
+        scope = {"type": "http", "headers": headers, "client": ("10.0.0.2", 80)}
+        return deps.client_host(Request(scope))
+
+    # Traefik appends the address it saw, whatever the client sent before it
+    assert client_host("1.1.1.1, 203.0.113.7") == "203.0.113.7"
+    assert client_host("2.2.2.2, 203.0.113.7") == "203.0.113.7"
+    assert client_host("203.0.113.7") == "203.0.113.7"
+
+
+async def test_recover_password_enqueues_email(client: AsyncClient) -> None:
+    r = await client.post(
+        f"{settings.api_v1_str}/recover-password/{settings.first_superuser}"
+    )
+    assert r.status_code == 200
+
+    async with async_session.begin() as db:
+        claimed = await crud.outbox.claim(db, 1000)
+    assert any(
+        row.task == send_reset_password_email.name
+        and row.args == [settings.first_superuser]
+        for row in claimed
+    )
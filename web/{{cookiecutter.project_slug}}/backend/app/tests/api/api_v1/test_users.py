@@ -1,7 +1,21 @@
+import asyncio
+import base64
+import csv
+import io
+import json
+import secrets
+from collections.abc import AsyncIterator
+
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import update
 
+from app import crud, models
+from app.api.api_v1 import users
 from app.config import settings
+from app.db import async_session
+from app.hashing import hasher
+from tests.utils import assert_max_queries, get_user_token_headers
 
 # This is the same as using the @pytest.mark.anyio on all test functions in the module
 pytestmark = pytest.mark.anyio
@@ -17,3 +31,493 @@ async def test_get_users_superuser_me(
     assert current_user["email"] == settings.first_superuser
     assert current_user["is_active"]
     assert current_user["is_superuser"]
+
+
+async def test_get_users_me_not_modified(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/me", headers=superuser_token_headers
+    )
+    tag = r.headers["ETag"]
+
+    r = await client.get(
+        f"{settings.api_v1_str}/users/me",
+        headers={**superuser_token_headers, "If-None-Match": tag},
+    )
+    assert r.status_code == 304
+    assert r.headers["ETag"] == tag
+
+
+async def test_get_users_batch(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/me", headers=superuser_token_headers
+    )
+    user_id = r.json()["id"]
+
+    r = await client.get(
+        f"{settings.api_v1_str}/users/batch",
+        headers=superuser_token_headers,
+        params={"ids": [user_id, -1]},
+    )
+    users = r.json()
+    assert [user["id"] for user in users] == [user_id]
+
+
+async def test_load_users_coalesced(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/me", headers=superuser_token_headers
+    )
+    user_id = r.json()["id"]
+
+    async with async_session() as db:
+        with assert_max_queries(1):
+            users = await asyncio.gather(
+                crud.user.load(db, user_id),
+                crud.user.load(db, user_id),
+                crud.user.load(db, -1),
+            )
+
+    assert [user and user.id for user in users] == [user_id, user_id, None]
+
+
+async def test_get_users_invalid_cursor(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        params={"cursor": "not-a-cursor"},
+    )
+    assert r.status_code == 400
+
+    # Empty, short, and a sort value of the wrong type
+    for key in ([], ["email"], ["email", "user@example.com"], ["email", 5, 1]):
+        cursor = base64.urlsafe_b64encode(json.dumps(key).encode())
+        r = await client.get(
+            f"{settings.api_v1_str}/users/",
+            headers=superuser_token_headers,
+            params={"order_by": "email", "cursor": cursor.decode().rstrip("=")},
+        )
+        assert r.status_code == 400
+
+
+async def test_get_users_total_count(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        params={"count": "exact"},
+    )
+    total = int(r.headers["X-Total-Count"])
+
+    await client.post(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"email": f"{secrets.token_hex(8)}@example.com", "password": "password"},
+    )
+    r = await client.get(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        params={"count": "exact"},
+    )
+    assert int(r.headers["X-Total-Count"]) == total + 1
+
+
+async def test_get_users_fields(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        params={"fields": ["email", "id"], "order_by": "email"},
+    )
+    users = r.json()
+    assert all(user.keys() == {"id", "email"} for user in users)
+
+    r = await client.get(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        params={"fields": "hashed_password"},
+    )
+    assert r.status_code == 400
+
+
+async def test_export_users_ndjson(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/export", headers=superuser_token_headers
+    )
+    users = [json.loads(line) for line in r.text.splitlines()]
+    assert settings.first_superuser in {user["email"] for user in users}
+    assert all("hashed_password" not in user for user in users)
+
+
+async def test_export_users_pages(
+    client: AsyncClient,
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        params={"count": "exact"},
+    )
+    total = int(r.headers["X-Total-Count"])
+
+    monkeypatch.setattr(users, "EXPORT_BATCH_SIZE", 2)
+    r = await client.get(
+        f"{settings.api_v1_str}/users/export",
+        headers=superuser_token_headers,
+        params={"format": "csv"},
+    )
+    ids = [int(row["id"]) for row in csv.DictReader(io.StringIO(r.text))]
+    # Every user exactly once, in id order across the pages
+    assert len(ids) == total
+    assert ids == sorted(set(ids))
+
+
+async def test_export_users_compressed(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.get(
+        f"{settings.api_v1_str}/users/export",
+        headers={**superuser_token_headers, "Accept-Encoding": "gzip"},
+    )
+    assert r.headers["content-encoding"] == "gzip"
+    assert settings.first_superuser in r.text
+
+
+async def test_import_users_ndjson(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    emails = [f"{secrets.token_hex(8)}@example.com" for _ in range(2)]
+    lines = [
+        {"email": emails[0], "password": "password"},
+        {"email": emails[1], "password": "password", "full_name": "Imported"},
+        {"email": settings.first_superuser, "password": "password"},
+        {"email": "not an email", "password": "password"},
+        {"email": f"{secrets.token_hex(8)}@example.com", "password": ["hunter2"]},
+    ]
+
+    r = await client.post(
+        f"{settings.api_v1_str}/users/import",
+        headers={**superuser_token_headers, "Content-Type": "application/x-ndjson"},
+        content="\n".join(json.dumps(line) for line in lines),
+    )
+    result = r.json()
+    assert result["created"] == 2
+    assert [error["row"] for error in result["errors"]] == [3, 4, 5]
+    assert result["errors"][2]["detail"].startswith("password: ")
+    assert "hunter2" not in r.text
+
+
+async def test_import_users_commits_batches(
+    client: AsyncClient,
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(users, "IMPORT_BATCH_SIZE", 1)
+    email = f"{secrets.token_hex(8)}@example.com"
+
+    async def chunks() -> AsyncIterator[bytes]:
+        yield json.dumps({"email": email, "password": "password"}).encode() + b"\n"
+        yield b"\xff\n"
+
+    # The first row is committed before the malformed second one fails the import
+    r = await client.post(
+        f"{settings.api_v1_str}/users/import",
+        headers={**superuser_token_headers, "Content-Type": "application/x-ndjson"},
+        content=chunks(),
+    )
+    assert r.status_code == 400
+
+    async with async_session() as db:
+        assert await crud.user.get_by_email(db, email)
+
+
+async def test_import_users_split_character(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    line = {"email": f"{secrets.token_hex(8)}@example.com", "password": "password"}
+    body = json.dumps({**line, "full_name": "Zoë"}, ensure_ascii=False).encode()
+    split = body.index("ë".encode()) + 1
+
+    async def chunks() -> AsyncIterator[bytes]:
+        # The second chunk starts halfway through the two bytes of "ë"
+        yield body[:split]
+        yield body[split:]
+
+    r = await client.post(
+        f"{settings.api_v1_str}/users/import",
+        headers={**superuser_token_headers, "Content-Type": "application/x-ndjson"},
+        content=chunks(),
+    )
+    assert r.status_code == 200
+    assert r.json()["created"] == 1
+
+
+async def test_update_users_requires_filter(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.patch(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"filter": {}, "is_active": False},
+    )
+    assert r.status_code == 400
+
+    r = await client.patch(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"filter": {"ids": [-1]}, "is_active": False},
+    )
+    assert r.json() == {"count": 0}
+
+
+async def test_update_users_by_filter(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    password = secrets.token_hex(8)
+    user_ids = []
+    for _ in range(2):
+        r = await client.post(
+            f"{settings.api_v1_str}/users/",
+            headers=superuser_token_headers,
+            json={"email": f"{secrets.token_hex(8)}@example.com", "password": password},
+        )
+        user_ids.append(r.json()["id"])
+
+    async with async_session() as db:
+        versions = {
+            user.id: user.version for user in await crud.user.get_many(db, user_ids)
+        }
+    # Cache the first user, the update has to evict it
+    r = await client.get(
+        f"{settings.api_v1_str}/users/{user_ids[0]}", headers=superuser_token_headers
+    )
+    assert r.json()["is_active"] is True
+
+    r = await client.patch(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"filter": {"ids": user_ids, "is_active": True}, "is_active": False},
+    )
+    assert r.json() == {"count": 2}
+
+    async with async_session() as db:
+        for user in await crud.user.get_many(db, user_ids):
+            assert not user.is_active
+            assert user.version == versions[user.id] + 1
+
+    r = await client.get(
+        f"{settings.api_v1_str}/users/{user_ids[0]}", headers=superuser_token_headers
+    )
+    assert r.json()["is_active"] is False
+
+
+async def test_update_users_keeps_current_superuser(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    for update_data in ({"is_active": False}, {"is_superuser": False}):
+        r = await client.patch(
+            f"{settings.api_v1_str}/users/",
+            headers=superuser_token_headers,
+            json={"filter": {"is_superuser": True}, **update_data},
+        )
+        assert r.status_code == 400
+
+    # Nothing was committed, the superuser can still use the API
+    r = await client.get(
+        f"{settings.api_v1_str}/users/me", headers=superuser_token_headers
+    )
+    assert r.status_code == 200
+    assert r.json()["is_superuser"] is True
+
+
+async def test_create_user_existing_email(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    hashes = hasher.counts["hash"]
+    r = await client.post(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"email": settings.first_superuser, "password": "password"},
+    )
+    assert r.status_code == 400
+    # Turned away before spending any time hashing the password
+    assert hasher.counts["hash"] == hashes
+
+
+async def test_create_user_enqueues_email_without_password(
+    client: AsyncClient,
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setitem(vars(settings), "emails_enabled", True)
+    email = f"{secrets.token_hex(8)}@example.com"
+    r = await client.post(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"email": email, "password": "password"},
+    )
+
+    async with async_session.begin() as db:
+        claimed = await crud.outbox.claim(db, 1000)
+    [row] = [row for row in claimed if row.args == [email]]
+    assert row.kwargs == {"username": email, "user_id": r.json()["id"]}
+
+
+async def test_update_user_single_query(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    # Start from an empty cache so the request below is the one that fills it
+    assert crud.user.cache is not None
+    crud.user.cache.clear()
+    r = await client.post(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"email": f"{secrets.token_hex(8)}@example.com", "password": "password"},
+    )
+    user_id = r.json()["id"]
+
+    # The current user is cached by now, leaving just the UPDATE ... RETURNING
+    with assert_max_queries(1):
+        r = await client.put(
+            f"{settings.api_v1_str}/users/{user_id}",
+            headers=superuser_token_headers,
+            json={"full_name": "Updated"},
+        )
+    assert r.json()["full_name"] == "Updated"
+
+
+async def test_update_user_me_ignores_stale_user(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    email = f"{secrets.token_hex(8)}@example.com"
+    r = await client.post(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"email": email, "password": "password", "is_superuser": True},
+    )
+    user_id = r.json()["id"]
+    headers = await get_user_token_headers(client, email, "password")
+
+    # Caches the user, then revoke superuser from outside the cache's reach
+    r = await client.get(f"{settings.api_v1_str}/users/me", headers=headers)
+    assert r.json()["is_superuser"]
+    async with async_session.begin() as db:
+        await db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(is_superuser=False)
+        )
+
+    r = await client.put(
+        f"{settings.api_v1_str}/users/me", headers=headers, json={"full_name": "x"}
+    )
+    assert r.json()["full_name"] == "x"
+    assert not r.json()["is_superuser"]
+
+    # The update dropped the cached user
+    r = await client.get(f"{settings.api_v1_str}/users/me", headers=headers)
+    assert r.json()["full_name"] == "x"
+    assert not r.json()["is_superuser"]
+
+
+async def test_update_user_changes_etag(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = await client.post(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"email": f"{secrets.token_hex(8)}@example.com", "password": "password"},
+    )
+    user_id = r.json()["id"]
+
+    r = await client.get(
+        f"{settings.api_v1_str}/users/{user_id}", headers=superuser_token_headers
+    )
+    tag = r.headers["ETag"]
+    headers = {**superuser_token_headers, "If-None-Match": tag}
+
+    r = await client.get(f"{settings.api_v1_str}/users/{user_id}", headers=headers)
+    assert r.status_code == 304
+
+    await client.put(
+        f"{settings.api_v1_str}/users/{user_id}",
+        headers=superuser_token_headers,
+        json={"full_name": "Updated"},
+    )
+    r = await client.get(f"{settings.api_v1_str}/users/{user_id}", headers=headers)
+    assert r.status_code == 200
+    assert r.headers["ETag"] != tag
+
+
+async def test_search_users(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    name = secrets.token_hex(8)
+    r = await client.post(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={
+            "email": f"{secrets.token_hex(8)}@example.com",
+            "password": "password",
+            "full_name": f"Search {name}",
+        },
+    )
+    user_id = r.json()["id"]
+
+    r = await client.get(
+        f"{settings.api_v1_str}/users/search",
+        headers=superuser_token_headers,
+        params={"q": name.upper()},
+    )
+    assert [user["id"] for user in r.json()] == [user_id]
+
+    r = await client.get(
+        f"{settings.api_v1_str}/users/search",
+        headers=superuser_token_headers,
+        params={"q": name, "prefix": True},
+    )
+    assert r.status_code == 204
+
+
+async def test_search_users_count_after_update(
+    client: AsyncClient, superuser_token_headers: dict[str, str]
+) -> None:
+    name = secrets.token_hex(8)
+    r = await client.post(
+        f"{settings.api_v1_str}/users/",
+        headers=superuser_token_headers,
+        json={"email": f"{secrets.token_hex(8)}@example.com", "password": "password"},
+    )
+    user_id = r.json()["id"]
+
+    params = {"q": name, "count": "exact"}
+    r = await client.get(
+        f"{settings.api_v1_str}/users/search",
+        headers=superuser_token_headers,
+        params=params,
+    )
+    assert r.headers["X-Total-Count"] == "0"
+
+    # Renaming the user into the results must not leave the cached count behind
+    await client.put(
+        f"{settings.api_v1_str}/users/{user_id}",
+        headers=superuser_token_headers,
+        json={"full_name": f"Search {name}"},
+    )
+    r = await client.get(
+        f"{settings.api_v1_str}/users/search",
+        headers=superuser_token_headers,
+        params=params,
+    )
+    assert r.headers["X-Total-Count"] == "1"
@@ -1,12 +1,16 @@
-from collections.abc import AsyncIterator
+import socket
+from collections.abc import AsyncIterator, Iterator
 
 import pytest
+from aiosmtpd.controller import Controller
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import utils
+from app.config import settings
 from app.db import async_session
 from app.main import app
-from tests.utils import get_superuser_token_headers
+from tests.utils import SMTPRecorder, get_superuser_token_headers
 
 
 @pytest.fixture(scope="session")
@@ -20,7 +24,8 @@ async def db() -> AsyncIterator[AsyncSession]:
         yield session
 
 
-@pytest.fixture(scope="module")
+# Session scoped so that pooled connections aren't reused across event loops
+@pytest.fixture(scope="session")
 async def client() -> AsyncIterator[AsyncClient]:
     async with AsyncClient(base_url="http://test", app=app) as ac:
         yield ac
@@ -29,3 +34,25 @@ async def client() -> AsyncIterator[AsyncClient]:
 @pytest.fixture(scope="module")
 async def superuser_token_headers(client: AsyncClient) -> dict[str, str]:
     return await get_superuser_token_headers(client)
+
+
+@pytest.fixture
+def smtp_server(monkeypatch: pytest.MonkeyPatch) -> Iterator[SMTPRecorder]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    recorder = SMTPRecorder()
+    controller = Controller(recorder, hostname="127.0.0.1", port=port)
+    controller.start()
+
+    monkeypatch.setattr(settings, "smtp_tls", False)
+    monkeypatch.setattr(settings, "smtp_host", controller.hostname)
+    monkeypatch.setattr(settings, "smtp_port", controller.port)
+    monkeypatch.setattr(settings, "smtp_user", "")
+    monkeypatch.setattr(settings, "emails_from_email", "noreply@example.com")
+    try:
+        yield recorder
+    finally:
+        utils.close_smtp()
+        controller.stop()
@@ -0,0 +1,52 @@
+import math
+
+import pytest
+from sqlalchemy import update
+
+from app import db, models
+from app.api import deps
+from app.config import settings
+
+
+@pytest.mark.anyio
+async def test_read_db_rejects_writes() -> None:
+    # Refused before a connection is even checked out
+    async for session in deps.get_read_db():
+        with pytest.raises(RuntimeError):
+            await session.execute(update(models.User).values(full_name="Written"))
+
+
+def test_read_session_picks_healthy_replicas(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Engines only connect on first use, so these hosts are never contacted
+    healthy, lagging, down = (
+        db.Replica(f"postgresql+asyncpg://app@replica{i}/app") for i in range(3)
+    )
+    lagging.lag = 30
+    down.lag = math.inf
+    monkeypatch.setattr(settings, "postgres_replica_max_lag", 10)
+    monkeypatch.setattr(db, "replicas", [healthy, lagging, down])
+
+    session = db.read_session().sync_session
+    for _ in range(10):
+        assert session.get_bind() is healthy.read_engine.sync_engine
+
+    # Requests that wrote keep reading from the primary
+    token = db.primary_pinned.set(True)
+    try:
+        assert session.get_bind() is session.bind
+    finally:
+        db.primary_pinned.reset(token)
+
+    healthy.lag = 60
+    assert session.get_bind() is session.bind
+
+
+def test_engine_options_pgbouncer(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "postgres_pgbouncer", True)
+
+    connect_args = db.engine_options()["connect_args"]
+    assert connect_args["statement_cache_size"] == 0
+    assert connect_args["prepared_statement_cache_size"] == 0
+    # Names must not collide on a server connection shared through PgBouncer
+    name = connect_args["prepared_statement_name_func"]
+    assert len({name() for _ in range(10)}) == 10
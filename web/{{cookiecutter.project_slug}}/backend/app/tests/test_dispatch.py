@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from collections.abc import Iterator
+from types import SimpleNamespace
+from typing import Any, cast
+
+import pytest
+from celery import Celery
+
+from app.dispatch import TaskDispatcher
+
+pytestmark = pytest.mark.anyio
+
+
+class StubConnection:
+    def __init__(self) -> None:
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class StubApp:
+    """
+    Stands in for the Celery app, publishing once unblocked and failing while error
+    is set
+    """
+
+    def __init__(self) -> None:
+        self.amqp = self
+        self.connections: list[StubConnection] = []
+        self.sent: list[str] = []
+        self.error: Exception | None = None
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+
+    def connection_for_write(self, **kwargs: Any) -> StubConnection:
+        connection = StubConnection()
+        self.connections.append(connection)
+        return connection
+
+    def Producer(self, connection: StubConnection, **kwargs: Any) -> SimpleNamespace:
+        return SimpleNamespace(connection=connection)
+
+    def send_task(self, name: str, **kwargs: Any) -> None:
+        self.unblocked.wait()
+        if self.error is not None:
+            raise self.error
+        self.sent.append(name)
+
+
+@pytest.fixture
+def stub_app() -> Iterator[StubApp]:
+    app = StubApp()
+    yield app
+    app.unblocked.set()
+
+
+def dispatcher_for(app: StubApp, max_pending: int, timeout: float) -> TaskDispatcher:
+    return TaskDispatcher(cast(Celery, app), max_pending, timeout)
+
+
+async def test_dispatch_counts_messages(stub_app: StubApp) -> None:
+    dispatcher = dispatcher_for(stub_app, 10, 1)
+    try:
+        await dispatcher.send(("a", [], {}), ("b", [], {}))
+        assert stub_app.sent == ["a", "b"]
+        assert (dispatcher.published, dispatcher.failed) == (2, 0)
+
+        stub_app.error = ConnectionError("broker went away")
+        with pytest.raises(ConnectionError):
+            await dispatcher.send(("c", [], {}))
+        assert (dispatcher.published, dispatcher.failed) == (2, 1)
+        assert dispatcher.pending == 0
+        # The failed publish closed the connection rather than reusing it
+        assert len(stub_app.connections) == 1
+        assert stub_app.connections[0].closed
+
+        stub_app.error = None
+        await dispatcher.send(("d", [], {}))
+        assert len(stub_app.connections) == 2
+        assert not stub_app.connections[1].closed
+        assert (dispatcher.published, dispatcher.failed) == (3, 1)
+    finally:
+        dispatcher.shutdown()
+
+
+async def test_dispatch_waits_for_pending(stub_app: StubApp) -> None:
+    dispatcher = dispatcher_for(stub_app, 1, 5)
+    try:
+        stub_app.unblocked.clear()
+        first = asyncio.create_task(dispatcher.send(("a", [], {})))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(dispatcher.send(("b", [], {})))
+        await asyncio.sleep(0.05)
+
+        # The second message waits for the first to leave the buffer
+        assert (dispatcher.pending, dispatcher.waiting) == (1, 1)
+        assert not second.done()
+
+        stub_app.unblocked.set()
+        await asyncio.gather(first, second)
+        assert stub_app.sent == ["a", "b"]
+        assert (dispatcher.pending, dispatcher.waiting) == (0, 0)
+    finally:
+        dispatcher.shutdown()
+
+
+async def test_dispatch_times_out_waiting(stub_app: StubApp) -> None:
+    dispatcher = dispatcher_for(stub_app, 1, 0.05)
+    try:
+        stub_app.unblocked.clear()
+        first = asyncio.create_task(dispatcher.send(("a", [], {})))
+        await asyncio.sleep(0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await dispatcher.send(("b", [], {}))
+        assert dispatcher.waiting == 0
+
+        stub_app.unblocked.set()
+        await first
+        assert stub_app.sent == ["a"]
+    finally:
+        dispatcher.shutdown()
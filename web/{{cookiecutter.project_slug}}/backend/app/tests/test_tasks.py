@@ -0,0 +1,61 @@
+import pytest
+from jinja2 import DictLoader, Environment
+
+from app import auth, tasks, utils
+from app.celery import app as celery_app
+from tests.utils import SMTPRecorder
+
+
+def test_task_routes() -> None:
+    queues = {
+        task.name: celery_app.amqp.router.route({}, task.name)["queue"].name
+        for task in (
+            tasks.send_reset_password_email,
+            tasks.send_new_account_emails,
+            tasks.send_new_account_email,
+        )
+    }
+
+    assert queues == {
+        tasks.send_reset_password_email.name: "high-priority",
+        tasks.send_new_account_emails.name: "bulk",
+        tasks.send_new_account_email.name: "main-queue",
+    }
+
+
+def test_send_email_reuses_connection(smtp_server: SMTPRecorder) -> None:
+    for i in range(3):
+        utils.send_email(mail_to=f"user{i}@example.com", subject="Hi", text="Hi")
+    utils.close_smtp()
+    utils.send_email(mail_to="user3@example.com", subject="Hi", text="Hi")
+
+    peers = [peer for peer, _ in smtp_server.messages]
+    assert peers[0] == peers[1] == peers[2] != peers[3]
+
+
+def test_send_new_account_emails(
+    smtp_server: SMTPRecorder, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    templates = {"new_account.html": "{{ link }}"}
+    monkeypatch.setattr(tasks, "env", Environment(loader=DictLoader(templates)))
+
+    emails = ["new0@example.com", "new@bounce.example.com", "new1@example.com"]
+    failed = tasks.send_new_account_emails(
+        [dict(to=email, username=email, user_id=i) for i, email in enumerate(emails)]
+    )
+
+    assert list(failed) == ["new@bounce.example.com"]
+    assert [message["To"] for _, message in smtp_server.messages] == [
+        "new0@example.com",
+        "new1@example.com",
+    ]
+    assert len({peer for peer, _ in smtp_server.messages}) == 1
+
+    # Each email links to setting a password as its own user
+    tokens = [
+        part.get_payload(decode=True).decode().rpartition("token=")[2]
+        for _, message in smtp_server.messages
+        for part in message.walk()
+        if part.get_content_type() == "text/html"
+    ]
+    assert [auth.decode_access_token(token).user_id for token in tokens] == [0, 2]
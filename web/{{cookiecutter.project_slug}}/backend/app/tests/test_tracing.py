@@ -0,0 +1,25 @@
+from app.tracing import TracesSampler
+
+
+def test_traces_sampler_longest_prefix() -> None:
+    sampler = TracesSampler(
+        0.1, {"/api/v1": 0.5, "/api/v1/login": 1.0, "/api/v1/users/me": 0.0}
+    )
+
+    def sample(path: str) -> float:
+        return sampler({"asgi_scope": {"path": path}})
+
+    assert sample("/api/v1/login/access-token") == 1.0
+    assert sample("/api/v1/users/me") == 0.0
+    assert sample("/api/v1/users/") == 0.5
+    assert sample("/docs") == 0.1
+    assert sampler({}) == 0.1
+
+
+def test_traces_sampler_follows_parent() -> None:
+    sampler = TracesSampler(0.1, {"/api/v1/login": 1.0})
+    scope = {"path": "/api/v1/login/access-token"}
+
+    assert sampler({"asgi_scope": scope, "parent_sampled": False}) == 0.0
+    assert sampler({"asgi_scope": {"path": "/docs"}, "parent_sampled": True}) == 1.0
+    assert sampler({"asgi_scope": scope, "parent_sampled": None}) == 1.0
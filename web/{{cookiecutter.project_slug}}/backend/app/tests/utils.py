@@ -1,6 +1,13 @@
-from typing import TYPE_CHECKING
+from collections.abc import Iterator
+from contextlib import contextmanager
+from email import message_from_bytes
+from email.message import Message
+from typing import TYPE_CHECKING, Any
+
+from sqlalchemy import event
 
 from app.config import settings
+from app.db import engine, replicas
 
 if TYPE_CHECKING:
     from httpx import AsyncClient
@@ -11,7 +18,7 @@ async def get_user_token_headers(
 ) -> dict[str, str]:
     r = await client.post(
         f"{settings.api_v1_str}/login/access-token",
-        data={"username": email, "password": password},
+        data={"username": email, "password": password, "scope": "me"},
     )
     content = r.json()
 
@@ -22,3 +29,51 @@ async def get_superuser_token_headers(client: "AsyncClient") -> dict[str, str]:
     return await get_user_token_headers(
         client, settings.first_superuser, settings.first_superuser_password
     )
+
+
+@contextmanager
+def assert_max_queries(n: int) -> Iterator[list[str]]:
+    statements: list[str] = []
+
+    def record(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        statements.append(statement)
+
+    # Reads may go to any replica as well as the primary
+    engines = [
+        engine.sync_engine,
+        *(replica.engine.sync_engine for replica in replicas),
+    ]
+    for listened in engines:
+        event.listen(listened, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for listened in engines:
+            event.remove(listened, "before_cursor_execute", record)
+
+    assert (
+        len(statements) <= n
+    ), f"{len(statements)} queries, expected at most {n}:\n" + "\n".join(statements)
+
+
+class SMTPRecorder:
+    """
+    aiosmtpd handler that keeps every message it accepts along with the client
+    address it came from, and refuses recipients at bounce.example.com
+    """
+
+    def __init__(self) -> None:
+        self.messages: list[tuple[Any, Message]] = []
+
+    async def handle_RCPT(
+        self, server: Any, session: Any, envelope: Any, address: str, options: Any
+    ) -> str:
+        if address.endswith("@bounce.example.com"):
+            return "550 No such user"
+
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server: Any, session: Any, envelope: Any) -> str:
+        self.messages.append((session.peer, message_from_bytes(envelope.content)))
+        return "250 OK"